@@ -16,12 +16,8 @@ path = os.path.dirname(os.path.abspath(__file__))
 st.set_page_config(page_title="Presiones-CDMX", layout="wide")
 
 #%% Datos iniciales
-db = dbs.DataBase()
-ids = db.get_stations_id()
-db.close()
-
-db = dbs.DataBase()
-db.close()
+with dbs.DataBase() as db:
+    ids = db.get_stations_id()
 
 st.session_state["ids"] = ids
 
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de desempeño de la base de datos de presiones
+
+Uso:
+    python benchmark.py --sizes 100 1000 10000
+    python benchmark.py --sizes 100 1000 --decoder
+
+@author: zaula
+"""
+
+#%% Importar librerias
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+import data_bases as dbs
+import pressure_storage as pstore
+
+
+#%% Datos sinteticos
+
+# Esquema original de la tabla de presiones (version 0)
+LEGACY_FIELDS = {
+    "ID": "INTEGER NOT NULL",
+    "Fecha": "text NOT NULL",
+    "Ano": "INTEGER NOT NULL",
+    "Mes": "INTEGER NOT NULL",
+    "Dia": "INTEGER NOT NULL",
+    "Hora": "INTEGER NOT NULL",
+    "Valor": "REAL"
+}
+
+# Columnas obligatorias de la tabla de estaciones
+LEGACY_STATIONS = {
+    "ID": "INTEGER PRIMARY KEY",
+    "Nombre": "text NOT NULL",
+    "X": "REAL NOT NULL",
+    "Y": "REAL NOT NULL",
+    "Carga": "REAL NOT NULL",
+    "Diametro": "INTEGER NOT NULL",
+    "Instalacion": "INTEGER NOT NULL",
+}
+
+
+def legacy_database(fname, station_years, stations=100, seed=0):
+    """
+    Crea una base de datos con el esquema original (sin llave primaria ni
+    indices), la tabla de estaciones y station_years años-estacion de
+    presiones horarias
+    """
+    years = max(1, int(np.ceil(station_years / stations)))
+    stations = min(stations, station_years)
+    conn = sqlite3.connect(fname)
+    fieldstr = ", ".join([f"{key} {value}" for key, value in LEGACY_FIELDS.items()])
+    conn.execute(f"CREATE TABLE presiones ({fieldstr})")
+    rng = np.random.default_rng(seed)
+    fieldstr = ", ".join([f"{key} {value}" for key, value in LEGACY_STATIONS.items()])
+    conn.execute(f"CREATE TABLE estaciones ({fieldstr})")
+    conn.executemany(
+        "INSERT INTO estaciones VALUES (?, ?, ?, ?, 0, 0, 2000)",
+        [(ide, f"Estacion {ide}", -99.3 + 0.3 * rng.random(), 19.2 + 0.3 * rng.random())
+         for ide in range(1, stations + 1)]
+    )
+    dates = pd.date_range("2000-01-01 00:00", periods=8760, freq="1h")
+    for year in range(years):
+        fechas = (dates + pd.DateOffset(years=year))
+        text = fechas.strftime("%Y-%m-%d %H:%M:%S")
+        ano, mes, dia, hora = fechas.year, fechas.month, fechas.day, fechas.hour
+        for ide in range(1, stations + 1):
+            values = np.round(rng.gamma(4.0, 0.5, len(fechas)), 3)
+            rows = zip([ide] * len(fechas), text, ano, mes, dia, hora, values)
+            conn.executemany("INSERT INTO presiones VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             ((int(a), b, int(c), int(d), int(e), int(f), float(g))
+                              for a, b, c, d, e, f, g in rows))
+        conn.commit()
+    return conn, stations, years
+
+
+#%% Consultas representativas de DataBase
+
+def _legacy_frame(conn, query, index=None, values=None):
+    # read_sql y pivot_table como en los metodos originales de DataBase
+    df = pd.read_sql(query, conn)
+    if values is not None:
+        return pd.pivot_table(df, values=values, index=index, columns="ID")
+    return df.set_index(index) if index is not None else df
+
+
+def _legacy_station_pressure(conn, query):
+    df = pd.read_sql(query, conn)
+    df["Fecha"] = pd.to_datetime(df["Fecha"])
+    return df.set_index("Fecha")["Valor"]
+
+
+def calls(stations, years):
+    """
+    Metodos de DataBase: implementacion original sobre el esquema original
+    (consultas y post-proceso de la version 0) y metodo actual
+    """
+    ide = stations // 2
+    year = 2000 + years // 2
+    day = f"{year}-06-15"
+    return {
+        "get_station_pressure(period=60 dias)": (
+            lambda conn: _legacy_station_pressure(
+                conn, f"SELECT Fecha, Valor FROM presiones WHERE ID = {ide}"
+                      f" AND Fecha BETWEEN '{year}-02-28 23:30' AND '{year}-04-30 23:30'"),
+            lambda db: db.get_station_pressure(ide, period=(f"{year}-03-01 00:00", f"{year}-04-30 23:00")),
+        ),
+        "get_hourly_pressure(todas)": (
+            lambda conn: _legacy_frame(
+                conn, f"SELECT ID, Valor FROM presiones WHERE Ano = {year} AND Mes = 6 AND Dia = 15 AND Hora = 12",
+                "ID"),
+            lambda db: db.get_hourly_pressure(day, 12),
+        ),
+        "get_pressure_by_day(todas)": (
+            lambda conn: _legacy_frame(
+                conn, f"SELECT ID, Hora, Valor FROM presiones"
+                      f" WHERE Fecha BETWEEN '{year}-06-14 23:30' AND '{year}-06-15 23:30'",
+                "Hora", "Valor"),
+            lambda db: db.get_pressure_by_day(day),
+        ),
+        "get_hourly_pressure_by_month(ide)": (
+            lambda conn: _legacy_frame(
+                conn, f"SELECT Hora, MIN(Valor) AS min, AVG(Valor) AS mean, MAX(Valor) AS max FROM presiones"
+                      f" WHERE ID = {ide} AND Ano = {year} AND Mes = 6 GROUP BY Hora",
+                "Hora"),
+            lambda db: db.get_hourly_pressure_by_month(year, 6, ide),
+        ),
+        "get_monthly_pressure_by_year(todas)": (
+            lambda conn: _legacy_frame(
+                conn, f"SELECT ID, Mes, AVG(Valor) AS mean FROM presiones WHERE Ano = {year} GROUP BY ID, Mes",
+                "Mes", "mean"),
+            lambda db: db.get_monthly_pressure_by_year(year),
+        ),
+    }
+
+
+def timeit(func, repeat=5):
+    # Mejor tiempo (ms) sin resultados guardados en query_cache
+    best = np.inf
+    for _ in range(repeat):
+        dbs.query_cache.clear()
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+
+#%% Principal
+
+def run(sizes):
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, "DataBase.sqlite")
+            conn, stations, years = legacy_database(fname, size)
+            tests = calls(stations, years)
+            before = {key: timeit(lambda: func[0](conn)) for key, func in tests.items()}
+            conn.close()
+            # la migracion se aplica al abrir la base de datos
+            t0 = time.perf_counter()
+            db = dbs.DataBase(location=fname)
+            tmigrate = time.perf_counter() - t0
+            try:
+                after = {key: timeit(lambda: func[1](db)) for key, func in tests.items()}
+            finally:
+                db.close()
+                dbs.get_pool(fname).close()
+        print(f"\n{size} años-estacion ({stations} estaciones x {years} años), migracion: {tmigrate:.1f} s")
+        for key in tests.keys():
+            results.append([size, key, before[key], after[key]])
+            print(f"  {key:40s} {before[key]:10.2f} ms {after[key]:10.2f} ms {before[key] / after[key]:8.1f}x")
+    return pd.DataFrame(results, columns=["AnosEstacion", "Consulta", "Antes (ms)", "Despues (ms)"])
+
+
+#%% Decodificacion de resultados
+
+def decoder(sizes, repeat=5):
+    """
+    Compara pd.read_sql con pressure_storage.fetch_frame en las consultas
+    de get_station_pressure, get_hourly_pressure y get_pressure_by_day
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, "DataBase.sqlite")
+            conn, stations, years = legacy_database(fname, size)
+            dbs.migrate(conn)
+            ide, year = stations // 2, 2000 + years // 2
+            t1, t2 = dbs.to_epoch(f"{year}-06-14 23:30"), dbs.to_epoch(f"{year}-06-15 23:30")
+            tests = {
+                "get_hourly_pressure(todas)": f"SELECT ID, Valor FROM presiones WHERE Tiempo = {t1 + 45000}",
+                "get_pressure_by_day(todas)": f"SELECT ID, Hora, Valor FROM presiones WHERE Tiempo BETWEEN {t1} AND {t2}",
+                "get_station_pressure(ide)": f"SELECT Tiempo, Valor FROM presiones WHERE ID = {ide} ORDER BY Tiempo",
+            }
+            print(f"\n{size} años-estacion ({stations} estaciones x {years} años)")
+            for key, query in tests.items():
+                columns = query.split("SELECT ")[1].split(" FROM")[0].split(", ")
+                before, after = np.inf, np.inf
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    df1 = pd.read_sql(query, conn)
+                    t1 = time.perf_counter()
+                    df2 = pstore.fetch_frame(conn, query, columns)
+                    t2 = time.perf_counter()
+                    before, after = min(before, t1 - t0), min(after, t2 - t1)
+                pd.testing.assert_frame_equal(df1, df2)
+                results.append([size, key, len(df1), before * 1000.0, after * 1000.0])
+                print(f"  {key:40s} {len(df1):8d} {before * 1000.0:10.2f} ms {after * 1000.0:10.2f} ms"
+                      f" {before / after:8.1f}x")
+            conn.close()
+    return pd.DataFrame(results, columns=["AnosEstacion", "Consulta", "Registros", "read_sql (ms)", "fetch_frame (ms)"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pruebas de desempeño de DataBase")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Años-estacion de datos horarios")
+    parser.add_argument("--decoder", action="store_true",
+                        help="Comparar pd.read_sql con la decodificacion a arreglos de NumPy")
+    args = parser.parse_args()
+    if args.decoder:
+        decoder(args.sizes)
+    else:
+        run(args.sizes)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Convertir los registros de presiones de DataBase.sqlite a otro almacenamiento
+
+Uso:
+    python convert_storage.py [--backend parquet|bloques|anual] [--fname Datos/DataBase.sqlite]
+                              [--folder Datos/Presiones] [--drop]
+
+@author: zaula
+"""
+
+#%% Importar librerias
+import argparse
+
+import data_bases as dbs
+
+
+#%% Conversion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convierte la tabla de presiones a otro almacenamiento")
+    parser.add_argument("--backend", default="parquet", choices=["parquet", "bloques", "anual"],
+                        help="Parquet particionado por año y mes, bloques comprimidos por estacion y mes"
+                             " o un archivo SQLite por año")
+    parser.add_argument("--fname", default=None, help="Base de datos SQLite (por omision Datos/DataBase.sqlite)")
+    parser.add_argument("--folder", default=None,
+                        help="Carpeta de salida de Parquet o de los archivos anuales (Datos/Presiones, Datos/Anual),"
+                             " se registra en la base de datos")
+    parser.add_argument("--drop", action="store_true",
+                        help="Eliminar los registros de SQLite despues de la conversion")
+    args = parser.parse_args()
+    flag, message = dbs.convert_storage(args.backend, args.fname, args.folder, drop=args.drop,
+                                         progress=dbs.print_progress)
+    print(message)
@@ -7,20 +7,1219 @@ Gestionar base de datos
 
 #%% Importar librerias
 import os
+import sys
+import json
+import time
+import tempfile
+import itertools
+import queue
+import datetime
+import inspect
+import functools
+import threading
+from collections import OrderedDict, deque
 import numpy as np
 import pandas as pd
 import sqlite3
+from urllib.parse import urlparse, parse_qs
+from urllib.request import pathname2url, url2pathname
+
+import pressure_cube as pcube
+import station_registry as sreg
+import pressure_storage as pstore
 
 path = os.path.abspath(os.path.dirname(__file__))
 
+# Version del esquema de la base de datos (PRAGMA user_version)
+SCHEMA_VERSION = 7
+
+# Tiempo: segundos desde 1970-01-01 00:00 (hora local sin zona), llave temporal
+PRESSURE_FIELDS = {
+    "ID": "INTEGER NOT NULL",
+    "Tiempo": "INTEGER NOT NULL",
+    "Fecha": "text NOT NULL",
+    "Ano": "INTEGER NOT NULL",
+    "Mes": "INTEGER NOT NULL",
+    "Dia": "INTEGER NOT NULL",
+    "Hora": "INTEGER NOT NULL",
+    "Valor": "REAL"
+}
+PRESSURE_KEY = ("ID", "Tiempo")
+# Indices de cobertura para las consultas por periodo y fecha (todas las
+# estaciones) y por estacion (estadisticos mensuales/anuales)
+# Las consultas por estacion usan la llave (ID, Tiempo) y las de año, mes,
+# dia u hora se convierten a intervalos de Tiempo (SQLiteStorage._where).
+# "tiempo" cubre las consultas de todas las estaciones en un periodo (mapa,
+# presiones por dia, matriz de presiones) sin recorrer la tabla; ocupa el
+# doble que un indice solo de Tiempo pero evita una busqueda en la llave por
+# registro (2 ms contra 4.6 ms por dia y 72 ms contra 157 ms por mes con 100
+# estaciones).
+PRESSURE_INDEXES = {
+    "tiempo": ("Tiempo", "ID", "Hora", "Valor"),
+}
+
+# Tablas de estadisticos agregados por estacion, año y mes
+# (sufijo de la tabla: columna adicional de agrupacion)
+ROLLUPS = {
+    "hora": "Hora",
+    "dia": "Dia",
+    "mes": None,
+}
+ROLLUP_FIELDS = {
+    "Minimo": "REAL",
+    "Suma": "REAL",
+    "Maximo": "REAL",
+    "Registros": "INTEGER NOT NULL",
+}
+
+
+#%% Tiempo
+
+def to_epoch(date):
+    """
+    Fecha a segundos desde 1970-01-01 00:00
+    """
+    return int(pd.Timestamp(date).value // 1_000_000_000)
+
+
+def from_epoch(values):
+    """
+    Segundos desde 1970-01-01 00:00 a DatetimeIndex (sin interpretar texto)
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu":
+        values = pd.array(values, dtype="Int64")  # valores nulos
+    return pd.to_datetime(values, unit="s")
+
+
+def downsample_m4(times, values, max_points):
+    """
+    Posiciones de los registros que conservan la envolvente de una serie
+    ordenada por tiempo con a lo mas max_points puntos (M4): primero, ultimo,
+    minimo y maximo de max_points // 4 intervalos de igual duracion.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) <= max_points:
+        return np.arange(len(times))
+    buckets = max(int(max_points) // 4, 1)
+    span = int(times[-1] - times[0]) + 1
+    bucket = (times - times[0]) * buckets // span
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    # orden por intervalo y valor: el primero de cada intervalo es el minimo
+    order = np.lexsort((values, bucket))
+    return np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+
+
+#%% Esquema y migraciones
+
+def _create_table(conn, table, fields, key):
+    fieldstr = ", ".join([f"{name} {value}" for name, value in fields.items()])
+    keystr = ", ".join(key)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({fieldstr}, PRIMARY KEY ({keystr})) WITHOUT ROWID")
+
+
+def _create_indexes(conn, table, indexes):
+    for name, columns in indexes.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{name} ON {table} ({', '.join(columns)})")
+
+
+def _rebuild_table(conn, table, fields, key, indexes, select):
+    # Copia la tabla a una nueva tabla WITHOUT ROWID y crea los indices al final.
+    # Los registros repetidos en la llave conservan el ultimo valor.
+    conn.execute(f"DROP TABLE IF EXISTS {table}_nueva")
+    _create_table(conn, f"{table}_nueva", fields, key)
+    conn.execute(f"INSERT OR REPLACE INTO {table}_nueva ({', '.join(fields.keys())}) {select}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_nueva RENAME TO {table}")
+    _create_indexes(conn, table, indexes)
+
+
+def create_pressure_table(conn, ptable="presiones", indexes=True):
+    """
+    Crea la tabla de presiones agrupada por (ID, Tiempo) y sus indices
+    """
+    _create_table(conn, ptable, PRESSURE_FIELDS, PRESSURE_KEY)
+    if indexes:
+        _create_indexes(conn, ptable, PRESSURE_INDEXES)
+
+
+def _rollup_group(column):
+    return ("ID", "Ano", "Mes") if column is None else ("ID", "Ano", "Mes", column)
+
+
+def create_rollup_tables(conn, ptable="presiones"):
+    for suffix, column in ROLLUPS.items():
+        group = _rollup_group(column)
+        fields = {name: "INTEGER NOT NULL" for name in group}
+        fields.update(ROLLUP_FIELDS)
+        _create_table(conn, f"{ptable}_{suffix}", fields, group)
+
+
+def update_rollups(conn, ptable="presiones", keys=None):
+    """
+    Recalcula los estadisticos agregados desde la tabla de presiones.
+    keys: lista de (ID, Ano, Mes) modificados, None recalcula todas las tablas.
+    No confirma la transaccion, se debe llamar dentro de la misma escritura.
+    """
+    stats = "MIN(Valor), SUM(Valor), MAX(Valor), COUNT(Valor)"
+    for suffix, column in ROLLUPS.items():
+        table = f"{ptable}_{suffix}"
+        group = ", ".join(_rollup_group(column))
+        if keys is None:
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} SELECT {group}, {stats} FROM {ptable} GROUP BY {group}")
+        else:
+            keys = [(int(a), int(b), int(c)) for a, b, c in keys]
+            conn.executemany(f"DELETE FROM {table} WHERE ID = ? AND Ano = ? AND Mes = ?", keys)
+            conn.executemany(
+                f"INSERT INTO {table} SELECT {group}, {stats} FROM {ptable}"
+                f" WHERE ID = ? AND Ano = ? AND Mes = ? GROUP BY {group}",
+                keys
+            )
+
+
+def update_rollups_frame(conn, frame, ptable="presiones"):
+    """
+    Igual que update_rollups a partir de los registros completos de los grupos
+    (ID, Ano, Mes) modificados, cuando las presiones no estan en SQLite.
+    No confirma la transaccion.
+    """
+    keys = frame[["ID", "Ano", "Mes"]].drop_duplicates().values.tolist()
+    for suffix, column in ROLLUPS.items():
+        table = f"{ptable}_{suffix}"
+        group = list(_rollup_group(column))
+        stats = frame.groupby(group)["Valor"].agg(["min", "sum", "max", "count"]).reset_index()
+        conn.executemany(f"DELETE FROM {table} WHERE ID = ? AND Ano = ? AND Mes = ?", keys)
+        marks = ", ".join(["?"] * (len(group) + 4))
+        conn.executemany(f"INSERT INTO {table} VALUES ({marks})", stats.astype(object).values.tolist())
+
+
+def create_metadata_table(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS metadatos (Clave text PRIMARY KEY, Valor) WITHOUT ROWID")
+    conn.execute("INSERT OR IGNORE INTO metadatos VALUES ('version_datos', 0)")
+
+
+def data_version(conn):
+    """
+    Contador de escrituras de datos, permite validar copias derivadas (cubo)
+    """
+    row = conn.execute("SELECT Valor FROM metadatos WHERE Clave = 'version_datos'").fetchone()
+    return 0 if row is None else int(row[0])
+
+
+def bump_data_version(conn):
+    # Se llama dentro de la transaccion de escritura
+    conn.execute("UPDATE metadatos SET Valor = Valor + 1 WHERE Clave = 'version_datos'")
+
+
+def stations_version(conn):
+    """
+    Contador de cambios de la tabla de estaciones (registro en memoria)
+    """
+    row = conn.execute("SELECT Valor FROM metadatos WHERE Clave = 'version_estaciones'").fetchone()
+    return 0 if row is None else int(row[0])
+
+
+def bump_stations_version(conn):
+    conn.execute("INSERT INTO metadatos VALUES ('version_estaciones', 1)"
+                 " ON CONFLICT(Clave) DO UPDATE SET Valor = Valor + 1")
+
+
+def storage_name(conn):
+    """
+    Almacenamiento de los registros de presiones: "sqlite", "parquet",
+    "bloques" o "anual". "sqlite" si la base de datos no esta migrada
+    (ubicaciones de solo lectura)
+    """
+    if not _table_exists(conn, "metadatos"):
+        return "sqlite"
+    row = conn.execute("SELECT Valor FROM metadatos WHERE Clave = 'almacenamiento'").fetchone()
+    return "sqlite" if row is None else row[0]
+
+
+def storage_folder(conn, folder, default):
+    """
+    Carpeta de los archivos Parquet o anuales registrada por convert_storage,
+    relativa a la carpeta de la base de datos (folder). Regresa
+    folder/default si no se registro
+    """
+    if not _table_exists(conn, "metadatos"):
+        return os.path.join(folder, default)
+    row = conn.execute("SELECT Valor FROM metadatos WHERE Clave = 'carpeta_almacenamiento'").fetchone()
+    return os.path.join(folder, default if row is None else row[0])
+
+
+def create_records_table(conn, ptable="presiones"):
+    # Primer y ultimo registro (Tiempo) y numero de registros por estacion
+    fields = {
+        "ID": "INTEGER NOT NULL",
+        "Inicio": "INTEGER",
+        "Final": "INTEGER",
+        "Registros": "INTEGER NOT NULL",
+    }
+    _create_table(conn, f"{ptable}_registros", fields, ("ID",))
+
+
+def update_records(conn, ptable="presiones", ids=None, periods=None):
+    """
+    Recalcula el periodo de registro de las estaciones indicadas (None: todas)
+    y el periodo global en metadatos. Usa la tabla agregada mensual, por lo que
+    se debe llamar despues de update_rollups. No confirma la transaccion.
+    periods: {ID: (tiempo1, tiempo2)} de los registros agregados, amplia el
+    periodo guardado sin consultar la tabla de presiones (almacenamiento Parquet).
+    """
+    table = f"{ptable}_registros"
+    stats = (f"ID, (SELECT MIN(Tiempo) FROM {ptable} AS p WHERE p.ID = m.ID),"
+             f" (SELECT MAX(Tiempo) FROM {ptable} AS p WHERE p.ID = m.ID), SUM(Registros)")
+    if periods is not None:
+        rows = [(int(key), int(t1), int(t2), int(key)) for key, (t1, t2) in periods.items()]
+        conn.executemany(
+            f"INSERT INTO {table} VALUES (?, ?, ?, (SELECT COALESCE(SUM(Registros), 0) FROM {ptable}_mes WHERE ID = ?))"
+            " ON CONFLICT (ID) DO UPDATE SET Inicio = MIN(Inicio, excluded.Inicio),"
+            " Final = MAX(Final, excluded.Final), Registros = excluded.Registros",
+            rows
+        )
+    elif ids is None:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} SELECT {stats} FROM {ptable}_mes AS m GROUP BY ID")
+    else:
+        ids = [(int(x),) for x in ids]
+        conn.executemany(f"DELETE FROM {table} WHERE ID = ?", ids)
+        conn.executemany(f"INSERT INTO {table} SELECT {stats} FROM {ptable}_mes AS m WHERE ID = ? GROUP BY ID", ids)
+    conn.execute(
+        f"INSERT OR REPLACE INTO metadatos SELECT 'tiempo_min', MIN(Inicio) FROM {table}"
+        f" UNION ALL SELECT 'tiempo_max', MAX(Final) FROM {table}"
+    )
+
+
+#%% Indices espaciales
+
+# Tablas R*Tree: extension (Xmin, Xmax, Ymin, Ymax) de cada estacion (punto)
+# y de cada celda de la malla de interpolacion
+SPATIAL_FIELDS = ("ID", "Xmin", "Xmax", "Ymin", "Ymax")
+
+
+def _create_spatial_table(conn, table):
+    # SQLite sin modulo RTREE: tabla normal con las mismas columnas
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING rtree({', '.join(SPATIAL_FIELDS)})")
+    except sqlite3.OperationalError:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (ID INTEGER PRIMARY KEY, Xmin REAL, Xmax REAL,"
+                     f" Ymin REAL, Ymax REAL)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_extension ON {table} (Xmin, Xmax, Ymin, Ymax)")
+
+
+def geometry_bbox(geometry):
+    """
+    Extension (xmin, xmax, ymin, ymax) de una geometria GeoJSON
+    """
+    coords = np.array(list(_flatten(geometry["coordinates"])), dtype=np.float64)
+    return coords[:, 0].min(), coords[:, 0].max(), coords[:, 1].min(), coords[:, 1].max()
+
+
+def _flatten(coords):
+    if isinstance(coords[0], (int, float)):
+        yield coords[:2]
+    else:
+        for item in coords:
+            yield from _flatten(item)
+
+
+def create_spatial_tables(conn, etable="estaciones"):
+    _create_spatial_table(conn, f"{etable}_rtree")
+    _create_spatial_table(conn, "malla_rtree")
+    conn.execute("CREATE TABLE IF NOT EXISTS malla (ID INTEGER PRIMARY KEY, X REAL NOT NULL, Y REAL NOT NULL)")
+
+
+def replace_table(conn, frame, table):
+    """
+    Reemplaza una tabla con las columnas y renglones de frame (como
+    DataFrame.to_sql con if_exists="replace") sin confirmar la transaccion
+    """
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(pd.io.sql.get_schema(frame, table, con=conn))
+    marks = ", ".join(["?"] * len(frame.columns))
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    conn.executemany(f"INSERT INTO {table} VALUES ({marks})", rows)
+
+
+def update_stations_index(conn, etable="estaciones"):
+    # bases de datos sin tabla de estaciones (se llena con update_stations)
+    if not _table_exists(conn, etable):
+        return
+    conn.execute(f"DELETE FROM {etable}_rtree")
+    conn.execute(f"INSERT INTO {etable}_rtree SELECT ID, X, X, Y, Y FROM {etable}")
+
+
+def load_grid(conn, folder=None):
+    """
+    Carga la malla de interpolacion (MallaCoordenadas.csv) y la extension de
+    cada celda (Malla.geojson). Sin el GeoJSON la celda es su centro.
+    """
+    if folder is None:
+        folder = os.path.join(path, "Datos")
+    fname = os.path.join(folder, "MallaCoordenadas.csv")
+    if not os.path.exists(fname):
+        return 0
+    grid = pd.read_csv(fname)
+    extent = pd.DataFrame({"ID": grid["ID"], "Xmin": grid["X"], "Xmax": grid["X"],
+                           "Ymin": grid["Y"], "Ymax": grid["Y"]}).set_index("ID", drop=False)
+    fname = os.path.join(folder, "Malla.geojson")
+    if os.path.exists(fname):
+        with open(fname, encoding="utf-8") as fid:
+            layer = json.load(fid)
+        for feature in layer["features"]:
+            ide = feature["properties"]["ID"]
+            if ide in extent.index:
+                extent.loc[ide, ["Xmin", "Xmax", "Ymin", "Ymax"]] = geometry_bbox(feature["geometry"])
+    conn.execute("DELETE FROM malla")
+    conn.execute("DELETE FROM malla_rtree")
+    conn.executemany("INSERT INTO malla VALUES (?, ?, ?)", grid[["ID", "X", "Y"]].astype(object).values.tolist())
+    conn.executemany("INSERT INTO malla_rtree VALUES (?, ?, ?, ?, ?)",
+                     extent[list(SPATIAL_FIELDS)].astype(object).values.tolist())
+    return len(grid)
+
+
+def _migration_1(conn, ptable):
+    # Tabla sin llave primaria a tabla agrupada por (ID, Fecha)
+    fields = {
+        "ID": "INTEGER NOT NULL",
+        "Fecha": "text NOT NULL",
+        "Ano": "INTEGER NOT NULL",
+        "Mes": "INTEGER NOT NULL",
+        "Dia": "INTEGER NOT NULL",
+        "Hora": "INTEGER NOT NULL",
+        "Valor": "REAL"
+    }
+    # sin indices secundarios, la migracion 2 reconstruye la tabla
+    select = f"SELECT {', '.join(fields.keys())} FROM {ptable} ORDER BY ID, Fecha"
+    _rebuild_table(conn, ptable, fields, ("ID", "Fecha"), {}, select)
+
+
+def _migration_2(conn, ptable):
+    # Columna entera Tiempo como llave temporal (ID, Tiempo)
+    fields = {
+        "ID": "INTEGER NOT NULL",
+        "Tiempo": "INTEGER NOT NULL",
+        "Fecha": "text NOT NULL",
+        "Ano": "INTEGER NOT NULL",
+        "Mes": "INTEGER NOT NULL",
+        "Dia": "INTEGER NOT NULL",
+        "Hora": "INTEGER NOT NULL",
+        "Valor": "REAL"
+    }
+    indexes = {
+        "tiempo": ("Tiempo", "ID", "Hora", "Valor"),
+    }
+    select = (f"SELECT ID, CAST(strftime('%s', Fecha) AS INTEGER), Fecha, Ano, Mes, Dia, Hora, Valor"
+              f" FROM {ptable} ORDER BY ID, Fecha")
+    _rebuild_table(conn, ptable, fields, ("ID", "Tiempo"), indexes, select)
+
+
+def _migration_3(conn, ptable):
+    # Tablas de estadisticos horarios, diarios y mensuales
+    create_rollup_tables(conn, ptable)
+    update_rollups(conn, ptable)
+
+
+def _migration_4(conn, ptable):
+    # Tabla de metadatos con la version de los datos
+    create_metadata_table(conn)
+    bump_data_version(conn)
+
+
+def _migration_5(conn, ptable):
+    # Periodo de registro por estacion y global (requiere los agregados)
+    create_records_table(conn, ptable)
+    update_records(conn, ptable)
+
+
+def _migration_6(conn, ptable):
+    # Indices R*Tree de estaciones y de la malla de interpolacion
+    create_spatial_tables(conn)
+    update_stations_index(conn)
+    load_grid(conn)
+
+
+def _migration_7(conn, ptable):
+    # Indices que duplicaban la llave (ID, Tiempo) o que se sustituyen por
+    # intervalos de Tiempo
+    for name in ("fecha", "periodo", "estacion"):
+        conn.execute(f"DROP INDEX IF EXISTS idx_{ptable}_{name}")
+
+
+# Migraciones que dejan paginas libres, el archivo se compacta al terminar
+COMPACT_MIGRATIONS = {1, 2, 7}
+
+MIGRATIONS = {
+    1: _migration_1,
+    2: _migration_2,
+    3: _migration_3,
+    4: _migration_4,
+    5: _migration_5,
+    6: _migration_6,
+    7: _migration_7,
+}
+
+
+def _table_exists(conn, table):
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(query, (table,)).fetchone()[0] > 0
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, ptable="presiones"):
+    """
+    Actualiza el esquema de una base de datos existente a SCHEMA_VERSION.
+    Cada migracion se aplica en su propia transaccion.
+    Regresa la version inicial de la base de datos.
+    """
+    version = schema_version(conn)
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[number](conn, ptable)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if COMPACT_MIGRATIONS.intersection(range(version + 1, SCHEMA_VERSION + 1)):
+        conn.execute("VACUUM")
+    return version
+
+
+#%% Carga de presiones
+
+def _date_fields(dates):
+    # Tiempo, Fecha, Ano, Mes, Dia y Hora de un arreglo datetime64
+    dates = np.asarray(dates, dtype="datetime64[s]")
+    days = dates.astype("datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    return (
+        dates.astype(np.int64),
+        np.char.replace(np.datetime_as_string(dates, unit="s"), "T", " "),
+        months.astype(np.int64) // 12 + 1970,
+        months.astype(np.int64) % 12 + 1,
+        (days - months.astype("datetime64[D]")).astype(np.int64) + 1,
+        (dates - days).astype(np.int64) // 3600,
+    )
+
+
+def pressure_rows(dates, ids, values):
+    """
+    Convierte una matriz ancha de presiones [fecha, estacion] en registros
+    (ID, Tiempo, Fecha, Ano, Mes, Dia, Hora, Valor) ordenados por estacion
+    y tiempo, omitiendo valores faltantes.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    # atributos de fecha una sola vez por renglon
+    time, text, year, month, day, hour = _date_fields(dates)
+    # orden estacion-tiempo, igual que la llave primaria
+    col, row = np.nonzero(~np.isnan(values.T))
+    return zip(
+        ids[col].tolist(), time[row].tolist(), text[row].tolist(), year[row].tolist(),
+        month[row].tolist(), day[row].tolist(), hour[row].tolist(), values[row, col].tolist()
+    )
+
+
+def pressure_records(ids, dates, values):
+    """
+    Igual que pressure_rows para registros en formato largo (ID, Fecha, Valor).
+    Los registros repetidos en (ID, Fecha) conservan el ultimo valor.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    time, text, year, month, day, hour = _date_fields(dates)
+    order = np.lexsort((time, ids))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (ids[order][1:] != ids[order][:-1]) | (time[order][1:] != time[order][:-1])
+    order = order[last & ~np.isnan(values[order])]
+    return zip(
+        ids[order].tolist(), time[order].tolist(), text[order].tolist(), year[order].tolist(),
+        month[order].tolist(), day[order].tolist(), hour[order].tolist(), values[order].tolist()
+    )
+
+
+def print_progress(rows, fraction):
+    print(f"Cargando presiones: {fraction:6.1%} ({rows} registros)", flush=True)
+
+
+def load_pressure_csv(conn, filename, ptable="presiones", chunksize=744, progress=None):
+    """
+    Carga un archivo ancho de presiones (una columna por estacion) por bloques
+    de renglones. Cada bloque se inserta en su propia transaccion, por lo que
+    la memoria utilizada no depende del tamaño del archivo.
+    progress(registros, fraccion) se llama despues de cada bloque, por
+    ejemplo print_progress.
+    Regresa los registros insertados y las llaves (ID, Ano, Mes) modificadas.
+    """
+    fields = ", ".join(PRESSURE_FIELDS.keys())
+    marks = ", ".join(["?"] * len(PRESSURE_FIELDS))
+    query = f"INSERT OR REPLACE INTO {ptable} ({fields}) VALUES ({marks})"
+    size = max(os.path.getsize(filename), 1)
+    total = 0
+    keys = set()
+    with open(filename, "rb") as fid:
+        reader = pd.read_csv(fid, index_col=[0], parse_dates=[0], chunksize=chunksize)
+        for chunk in reader:
+            ids = chunk.columns.astype(int)
+            rows = list(pressure_rows(chunk.index.values, ids, chunk.to_numpy(dtype=np.float64)))
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(query, rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            keys.update({(row[0], row[3], row[4]) for row in rows})
+            total += len(rows)
+            if progress is not None:
+                progress(total, min(fid.tell() / size, 1.0))
+    return total, keys
+
+
+#%% Conversion de almacenamiento
+
+def convert_storage(backend="parquet", fname=None, folder=None, ptable="presiones", drop=False,
+                    progress=None):
+    """
+    Convierte la tabla de presiones de una base de datos existente al
+    almacenamiento indicado y lo registra en metadatos (junto con folder):
+        "parquet": archivos Parquet particionados por año y mes (folder, por
+                   omision Datos/Presiones)
+        "bloques": bloques comprimidos por estacion y mes en la misma base de
+                   datos (valores redondeados a 0.001 kg/cm2)
+        "anual":   un archivo SQLite por año (folder, por omision Datos/Anual)
+    Los agregados, metadatos y estaciones se mantienen en SQLite. drop=True
+    elimina los registros de la tabla de presiones y compacta el archivo.
+    """
+    if fname is None:
+        fname = os.path.join(path, "Datos", "DataBase.sqlite")
+    conn = sqlite3.connect(f"file:{pathname2url(fname)}", uri=True, isolation_level=None)
+    try:
+        migrate(conn, ptable)
+        stored = storage_name(conn)
+        if stored != "sqlite":
+            return False, f"La base de datos ya utiliza almacenamiento '{stored}'."
+        if backend == "parquet":
+            if folder is None:
+                folder = os.path.join(os.path.dirname(fname), "Presiones")
+            store = pstore.ParquetStorage(folder)
+        elif backend == "bloques":
+            store = pstore.BlockStorage(conn, ptable)
+            store.create()
+        elif backend == "anual":
+            if folder is None:
+                folder = os.path.join(os.path.dirname(fname), "Anual")
+            store = pstore.AnnualStorage(conn, folder, PRESSURE_FIELDS, PRESSURE_KEY, PRESSURE_INDEXES, ptable)
+        else:
+            return False, f"Almacenamiento '{backend}' no valido."
+        fields = ", ".join(pstore.COLUMNS)
+        months = conn.execute(f"SELECT DISTINCT Ano, Mes FROM {ptable}_mes ORDER BY Ano, Mes").fetchall()
+        total = 0
+        for i, (year, month) in enumerate(months):
+            frame = pd.read_sql(
+                f"SELECT {fields} FROM {ptable} WHERE Ano = {year} AND Mes = {month} ORDER BY ID, Tiempo",
+                conn
+            )
+            if hasattr(store, "prepare"):
+                store.prepare(frame)
+            conn.execute("BEGIN")
+            try:
+                store.write_month(year, month, frame)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            total += len(frame)
+            if progress is not None:
+                progress(total, (i + 1) / len(months))
+        conn.execute("BEGIN")
+        conn.execute("INSERT OR REPLACE INTO metadatos VALUES ('almacenamiento', ?)", (backend,))
+        if backend in ("parquet", "anual"):
+            # relativa a la base de datos si esta dentro de su carpeta
+            folder = os.path.abspath(folder)
+            try:
+                relative = os.path.relpath(folder, os.path.abspath(os.path.dirname(fname)))
+            except ValueError:
+                relative = os.pardir
+            if not relative.startswith(os.pardir):
+                folder = relative
+            conn.execute("INSERT OR REPLACE INTO metadatos VALUES ('carpeta_almacenamiento', ?)", (folder,))
+        bump_data_version(conn)
+        if drop:
+            conn.execute(f"DELETE FROM {ptable}")
+        conn.commit()
+        if drop:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return True, f"Se convirtieron {total} registros al almacenamiento '{backend}'."
+
+
+#%% Conexiones
+
+# Pragmas aplicados a cada conexion nueva
+PRAGMAS = {
+    "mmap_size": 268435456,   # 256 MB
+    "cache_size": -65536,     # 64 MB
+    "temp_store": "MEMORY",
+}
+
+
+class ConnectionPool:
+    """
+    Conexiones reutilizables a un archivo SQLite, compartidas entre hilos
+    y sesiones de Streamlit del mismo proceso
+    """
+
+    def __init__(self, fname, readonly=False, size=8, timeout=30.0):
+        self.fname = fname
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._checkouts = 0
+        self._waits = 0
+
+    def _connect(self):
+        if self.fname.startswith("file:"):
+            uri = self.fname
+        elif self.readonly:
+            uri = f"file:{pathname2url(self.fname)}?mode=ro"
+        else:
+            uri = f"file:{pathname2url(self.fname)}"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        for key, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {key} = {value}")
+        return conn
+
+    def acquire(self):
+        """
+        Entrega una conexion libre. Si ya hay size conexiones en uso espera
+        hasta timeout segundos a que se libere una y despues lanza TimeoutError
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._open < self.size
+                if create:
+                    self._open += 1
+                else:
+                    self._waits += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"Las {self.size} conexiones a '{self.fname}' siguieron ocupadas"
+                        f" después de {self.timeout:g} s."
+                    ) from None
+        with self._lock:
+            self._checkouts += 1
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def statistics(self):
+        with self._lock:
+            return {
+                "Archivo": self.fname,
+                "SoloLectura": self.readonly,
+                "Abiertas": self._open,
+                "Libres": self._idle.qsize(),
+                "EnUso": self._open - self._idle.qsize(),
+                "Solicitudes": self._checkouts,
+                "Esperas": self._waits,
+            }
+
+
+_pools = {}
+_initialized = set()
+_pools_lock = threading.RLock()
+
+
+def _key(fname):
+    return fname if fname.startswith("file:") else os.path.abspath(fname)
+
+
+def get_pool(fname, readonly=False):
+    key = (_key(fname), bool(readonly))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(key[0], readonly=key[1])
+        return _pools[key]
+
+
+def pool_statistics():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return pd.DataFrame([pool.statistics() for pool in pools])
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        _initialized.clear()
+
+
+_memory_ids = itertools.count(1)
+_memory_folders = {}
+
+
+def _memory_folder(name):
+    # Carpeta temporal de archivos auxiliares de cada base de datos en memoria
+    with _pools_lock:
+        if name not in _memory_folders:
+            _memory_folders[name] = tempfile.mkdtemp(prefix=f"{name}_")
+        return _memory_folders[name]
+
+
+def _wal_mode(fname):
+    # Bytes 18 y 19 del encabezado de SQLite: 2 en modo WAL
+    try:
+        with open(fname, "rb") as fid:
+            header = fid.read(20)
+    except OSError:
+        return False
+    return len(header) == 20 and header[18] == 2
+
+
+def resolve_location(location, default):
+    """
+    Ubicacion de una base de datos: None (default), ruta del archivo,
+    ":memory:" (base de datos nueva en memoria compartida por el proceso) o
+    URI "file:..." como file:ruta?mode=ro&immutable=1 o
+    file:nombre?mode=memory&cache=shared.
+    Regresa el nombre para las conexiones, la carpeta de archivos auxiliares
+    (cubo, Parquet, archivos anuales) y si la ubicacion es de solo lectura.
+    Las bases de datos en memoria usan una carpeta temporal propia.
+    immutable=1 no lee el registro WAL, por lo que solo se admite para
+    archivos fuera del modo WAL (la base de datos principal se escribe en
+    modo WAL); en otro caso se usa mode=ro.
+    """
+    if location is None:
+        location = default
+    if location == ":memory:":
+        name = os.path.splitext(os.path.basename(default))[0]
+        location = f"file:{name}_{next(_memory_ids)}?mode=memory&cache=shared"
+    if location.startswith("file:"):
+        url = urlparse(location)
+        params = parse_qs(url.query)
+        readonly = params.get("mode") == ["ro"] or params.get("immutable") == ["1"]
+        if params.get("mode") == ["memory"]:
+            return location, _memory_folder(url.path), readonly
+        fname = os.path.abspath(url2pathname(url.path))
+        if params.get("immutable") == ["1"] and _wal_mode(fname):
+            raise ValueError(f"La base de datos '{fname}' está en modo WAL y no se puede abrir con immutable=1,"
+                             " utiliza mode=ro.")
+        return location, os.path.dirname(fname), readonly
+    location = os.path.abspath(location)
+    return location, os.path.dirname(location), False
+
+
+def load_snapshot(fname=None, name="Snapshot"):
+    """
+    Copia una base de datos completa a memoria compartida del proceso (API de
+    respaldo de SQLite) y regresa la ubicacion para DataBase(location=...).
+    La copia se conserva mientras su pool tenga conexiones abiertas y no ve
+    los cambios posteriores del archivo. Los archivos Parquet o anuales se
+    siguen leyendo de la carpeta original.
+    """
+    if fname is None:
+        fname = os.path.join(path, "Datos", "DataBase.sqlite")
+    location = f"file:{name}?mode=memory&cache=shared"
+    pool = get_pool(location)
+    conn = pool.acquire()
+    try:
+        source = sqlite3.connect(f"file:{pathname2url(os.path.abspath(fname))}?mode=ro", uri=True)
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+        if _table_exists(conn, "metadatos"):
+            stored = storage_name(conn)
+            if stored in ("parquet", "anual"):
+                folder = storage_folder(conn, os.path.dirname(os.path.abspath(fname)),
+                                        "Presiones" if stored == "parquet" else "Anual")
+                conn.execute("INSERT OR REPLACE INTO metadatos VALUES ('carpeta_almacenamiento', ?)",
+                             (os.path.abspath(folder),))
+                conn.commit()
+    finally:
+        pool.release(conn)
+    return location
+
+
+def _reset_database(conn):
+    # Elimina todo el contenido del archivo copiando una base de datos vacia
+    empty = sqlite3.connect(":memory:")
+    try:
+        empty.backup(conn)
+    finally:
+        empty.close()
+
+
+def _initialize_once(fname, init_func):
+    # Crea o migra cada archivo una sola vez por proceso
+    key = _key(fname)
+    if key in _initialized:
+        return
+    with _pools_lock:
+        if key not in _initialized:
+            init_func()
+            _initialized.add(key)
+
+
+#%% Cache de consultas
+
+class QueryCache:
+    """
+    Cache LRU de resultados de consultas compartida por todas las sesiones del
+    proceso. Las llaves incluyen la version de los datos, por lo que cualquier
+    escritura invalida los resultados anteriores. El tamaño se limita en bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def sizeof(value):
+        if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+            return int(np.sum(value.memory_usage(deep=True))) + 100
+        if isinstance(value, np.ndarray):
+            return value.nbytes + 100
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(sys.getsizeof(x) for x in value)
+        return sys.getsizeof(value)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self._hits += 1
+                return True, self._data[key][0]
+            self._misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old) = self._data.popitem(last=False)
+                self._bytes -= old
+                self._evictions += 1
+
+    def invalidate(self, fname=None, version=None):
+        """
+        Elimina los resultados de un archivo (todos si fname es None) con
+        version de datos distinta a version (todas si version es None)
+        """
+        with self._lock:
+            for key in list(self._data.keys()):
+                if (fname is None or key[0] == fname) and (version is None or key[2] != version):
+                    self._bytes -= self._data.pop(key)[1]
+                    self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def statistics(self):
+        with self._lock:
+            return {
+                "Registros": len(self._data),
+                "Bytes": self._bytes,
+                "BytesMax": self.max_bytes,
+                "Aciertos": self._hits,
+                "Fallos": self._misses,
+                "Desalojos": self._evictions,
+            }
+
+
+query_cache = QueryCache()
+
+
+def _normalize(value):
+    # Argumentos equivalentes generan la misma llave
+    if isinstance(value, (list, tuple, np.ndarray, pd.Index, pd.Series)):
+        return tuple(_normalize(x) for x in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.date, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    return value
+
+
+def _copy(value):
+    # Copia de tablas, arreglos y de los contenedores que los incluyen
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value.copy()
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy(item) for item in value)
+    return value
+
+
+def cached_query(method):
+    """
+    Guarda el resultado del metodo en query_cache. Regresa copias para que
+    las paginas puedan modificar los resultados.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = tuple((name, _normalize(value)) for name, value in list(bound.arguments.items())[1:])
+        version = data_version(self.conn)
+        key = (self.fname, self.engine, version, self.storage.name, method.__name__, arguments)
+        try:
+            hit, value = query_cache.get(key)
+        except TypeError:  # argumentos no validos como llave
+            value = method(self, *args, **kwargs)
+            query_stats._local.hit = False
+            return value
+        if not hit:
+            value = method(self, *args, **kwargs)
+            query_cache.put(key, value)
+        # resultado de esta llamada para instrumented
+        query_stats._local.hit = hit
+        return _copy(value)
+    wrapper.cached = True
+    return wrapper
+
+
+#%% Instrumentacion
+
+class QueryStats:
+    """
+    Tiempos y registros de las consultas por metodo en una ventana de las
+    ultimas size llamadas, y registro de consultas lentas (duracion mayor o
+    igual a threshold segundos). explain=True guarda el EXPLAIN QUERY PLAN
+    de las sentencias de las consultas lentas. Las llamadas resueltas con
+    query_cache se registran aparte y no cuentan en los percentiles.
+    """
+
+    # limites de los intervalos del histograma (ms)
+    bins = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, np.inf)
+
+    def __init__(self, threshold=0.5, explain=False, size=1000, slow_size=200):
+        self.threshold = threshold
+        self.explain = explain
+        self.size = size
+        self._calls = {}
+        self._hits = {}
+        self._slow = deque(maxlen=slow_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, method, duration, rows, arguments=None, plan=None, hit=False):
+        with self._lock:
+            if hit:
+                if method not in self._hits:
+                    self._hits[method] = deque(maxlen=self.size)
+                self._hits[method].append(duration)
+                return
+            if method not in self._calls:
+                self._calls[method] = deque(maxlen=self.size)
+            self._calls[method].append((duration, rows))
+            if duration >= self.threshold:
+                self._slow.append({
+                    "Fecha": pd.Timestamp.now(),
+                    "Metodo": method,
+                    "Argumentos": str(arguments),
+                    "Duracion (ms)": duration * 1000.0,
+                    "Registros": rows,
+                    "Plan": plan,
+                })
+
+    def statistics(self):
+        """
+        Llamadas, percentiles de duracion (ms) y registros promedio por metodo,
+        y llamadas resueltas con query_cache con su duracion promedio (ms)
+        """
+        with self._lock:
+            calls = {key: np.array(value, dtype=np.float64) for key, value in self._calls.items()}
+            hits = {key: np.array(value, dtype=np.float64) * 1000.0 for key, value in self._hits.items()}
+        table = []
+        for method in sorted(set(calls.keys()) | set(hits.keys())):
+            values = calls.get(method, np.empty((0, 2)))
+            cached = hits.get(method, np.empty(0))
+            times = values[:, 0] * 1000.0
+            rows = values[~np.isnan(values[:, 1]), 1]
+            if len(times) > 0:
+                percentiles = [times.mean(), *np.percentile(times, [50, 95, 99]), times.max()]
+            else:
+                percentiles = [np.nan] * 5
+            table.append([
+                method, len(values), *percentiles, rows.mean() if len(rows) > 0 else np.nan,
+                len(cached), cached.mean() if len(cached) > 0 else np.nan,
+            ])
+        columns = [
+            "Metodo", "Llamadas", "Promedio (ms)", "P50 (ms)", "P95 (ms)", "P99 (ms)", "Max (ms)", "Registros",
+            "Cache", "Cache (ms)",
+        ]
+        return pd.DataFrame(table, columns=columns).set_index("Metodo")
+
+    def histogram(self):
+        """
+        Llamadas por intervalo de duracion (ms) para cada metodo
+        """
+        with self._lock:
+            calls = {key: [x[0] * 1000.0 for x in value] for key, value in self._calls.items()}
+        labels = [f"{a:g}-{b:g}" for a, b in zip(self.bins[:-2], self.bins[1:-1])] + [f">{self.bins[-2]:g}"]
+        table = {method: np.histogram(values, bins=self.bins)[0] for method, values in sorted(calls.items())}
+        return pd.DataFrame(table, index=pd.Index(labels, name="Duracion (ms)")).transpose()
+
+    def slow_queries(self):
+        with self._lock:
+            return pd.DataFrame(list(self._slow))
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+            self._hits.clear()
+            self._slow.clear()
+
+    def _statements(self):
+        # sentencias capturadas por las llamadas activas del hilo
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _explain(self, conn, statements):
+        plans = []
+        for statement in statements:
+            if not statement.lstrip().upper().startswith("SELECT"):
+                continue
+            try:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+            except sqlite3.Error:
+                continue
+            plans.append(statement + "\n" + "\n".join([f"  {row[-1]}" for row in rows]))
+        return "\n".join(plans) if plans else None
+
+
+query_stats = QueryStats()
+
+
+def instrumented(method):
+    """
+    Registra en query_stats la duracion y los registros regresados por el
+    metodo, si el resultado salio de query_cache y, con query_stats.explain,
+    las sentencias SQL ejecutadas en self.conn durante la llamada
+    """
+    signature = inspect.signature(method)
+    name = method.__qualname__
+    cached = getattr(method, "cached", False)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        explain = query_stats.explain
+        statements = []
+        if explain:
+            stack = query_stats._statements()
+            stack.append(statements)
+
+            def trace(sql):
+                for active in stack:
+                    active.append(sql)
+
+            if len(stack) == 1:
+                self.conn.set_trace_callback(trace)
+        start = time.perf_counter()
+        try:
+            value = method(self, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            if explain:
+                stack.pop()
+                if len(stack) == 0 and self.conn is not None:
+                    self.conn.set_trace_callback(None)
+        hit = cached and query_stats._local.hit
+        rows = len(value) if hasattr(value, "__len__") else np.nan
+        plan = None
+        if duration >= query_stats.threshold and explain and not hit:
+            plan = query_stats._explain(self.conn, statements)
+        arguments = None
+        if duration >= query_stats.threshold and not hit:
+            bound = signature.bind(self, *args, **kwargs)
+            arguments = {key: _normalize(value) for key, value in list(bound.arguments.items())[1:]}
+        query_stats.record(name, duration, rows, arguments, plan, hit)
+        return value
+
+    return wrapper
+
 
 #%% Clases
 
 class DataBase:
+    """
+    Base de datos de estaciones y presiones.
+    engine="cube" responde get_hourly_pressure y get_pressure_by_day desde el
+    cubo float32 estacion x hora (pressure_cube), reconstruido cuando cambia
+    la version de los datos en SQLite.
+    Los registros de presiones se leen del almacenamiento indicado en
+    metadatos (pressure_storage): la tabla de SQLite, archivos Parquet en
+    Datos/Presiones, bloques comprimidos por estacion y mes o un archivo
+    SQLite por año en Datos/Anual (ver convert_storage). backend permite leer
+    de otro almacenamiento en modo de solo lectura.
+    """
 
-    def __init__(self):
-        self.folder = os.path.join(path, "Datos")
-        self.fname = os.path.join(self.folder, "DataBase.sqlite")
+    def __init__(self, readonly=False, engine="sqlite", backend=None, location=None):
+        self.fname, self.folder, fixed = resolve_location(location, os.path.join(path, "Datos", "DataBase.sqlite"))
         self.etable = "estaciones"
         self.ptable = "presiones"
         self.efields = {
@@ -44,67 +1243,185 @@ class DataBase:
             "FuenteNombre2": "text",
             "FuenteUbicacion2": "text",
         }
-        self.pfields = {
-            "ID": "INTEGER NOT NULL",
-            "Fecha": "text NOT NULL",
-            "Ano": "INTEGER NOT NULL",
-            "Mes": "INTEGER NOT NULL",
-            "Dia": "INTEGER NOT NULL",
-            "Hora": "INTEGER NOT NULL",
-            "Valor": "REAL"
-        }
-        self.init_db()
+        self.pfields = dict(PRESSURE_FIELDS)
+        self.readonly = readonly or fixed
+        if not fixed:
+            _initialize_once(self.fname, self.init_db)
+        self.pool = get_pool(self.fname, self.readonly)
+        self.conn = self.pool.acquire()
+        stored = storage_name(self.conn)
+        if backend is None:
+            backend = stored
+        elif backend != stored and not self.readonly:
+            self.close()
+            raise ValueError(f"La base de datos utiliza almacenamiento '{stored}', solo se puede leer de '{backend}'.")
+        if backend == "parquet":
+            self.storage = pstore.ParquetStorage(storage_folder(self.conn, self.folder, "Presiones"))
+        elif backend == "bloques":
+            self.storage = pstore.BlockStorage(self.conn, self.ptable)
+        elif backend == "anual":
+            self.storage = pstore.AnnualStorage(self.conn, storage_folder(self.conn, self.folder, "Anual"), self.pfields,
+                                                PRESSURE_KEY, PRESSURE_INDEXES, self.ptable, self.readonly)
+        else:
+            self.storage = pstore.SQLiteStorage(self.conn, self.ptable)
+        self.engine = engine
+        if engine == "cube":
+            self.get_cube()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
     
     def init_db(self):
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
-        if not os.path.exists(self.fname):
-            self.conn = sqlite3.connect(self.fname)
-            cursor = self.conn.cursor()
-            fieldstr = ", ".join([f"{key} {value}" for key, value in self.efields.items()])
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.etable} ({fieldstr})")
-            fieldstr = ", ".join([f"{key} {value}" for key, value in self.pfields.items()])
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.ptable} ({fieldstr})")
-            self.conn.commit()
-            
-            df = pd.read_csv(os.path.join(path, "DatosIniciales", "Estaciones.csv"))
-            df.to_sql(self.etable, self.conn, if_exists="replace", index=False)
+        pool = get_pool(self.fname)
+        conn = pool.acquire()
+        try:
+            if _table_exists(conn, self.etable) and schema_version(conn) == 0 and _table_exists(conn, "metadatos"):
+                # creacion interrumpida antes de terminar la carga inicial
+                _reset_database(conn)
+            if not _table_exists(conn, self.etable):
+                self.create_db(conn)
+            else:
+                migrate(conn, self.ptable)
+        finally:
+            pool.release(conn)
+
+    def create_db(self, conn):
+        # La version del esquema se asigna al terminar la carga inicial; una
+        # base de datos con metadatos y version 0 no termino de crearse
+        cursor = conn.cursor()
+        fieldstr = ", ".join([f"{key} {value}" for key, value in self.efields.items()])
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.etable} ({fieldstr})")
+        create_pressure_table(conn, self.ptable, indexes=False)
+        create_rollup_tables(conn, self.ptable)
+        create_metadata_table(conn)
+        create_records_table(conn, self.ptable)
+        conn.commit()
+
+        df = pd.read_csv(os.path.join(path, "DatosIniciales", "Estaciones.csv"))
+        df.to_sql(self.etable, conn, if_exists="replace", index=False)
+        conn.execute("BEGIN")
+        create_spatial_tables(conn, self.etable)
+        update_stations_index(conn, self.etable)
+        load_grid(conn)
+        conn.commit()
             
-            df = pd.read_csv(os.path.join(path, "DatosIniciales", "Presiones.csv"),
-                             index_col=[0], parse_dates=[0])
-            d = df.melt(ignore_index=False).reset_index(False)
-            d["Ano"] = d.iloc[:, 0].dt.year
-            d["Mes"] = d.iloc[:, 0].dt.month
-            d["Dia"] = d.iloc[:, 0].dt.day
-            d["Hora"] = d.iloc[:, 0].dt.hour
-            d.iloc[:, 1] = d.iloc[:, 1].astype(int)
-            d.columns = ["Fecha", "ID", "Valor", "Ano", "Mes", "Dia", "Hora"]
-            d = d.loc[:, ["ID", "Fecha", "Ano", "Mes", "Dia", "Hora", "Valor"]]
-            d = d.dropna()
-            d.to_sql(self.ptable, self.conn, if_exists="replace", index=False)
-                        
-        else:
-            self.conn = sqlite3.connect(self.fname)
+        # indices secundarios y agregados al final de la carga
+        load_pressure_csv(conn, os.path.join(path, "DatosIniciales", "Presiones.csv"), self.ptable)
+        conn.execute("BEGIN")
+        _create_indexes(conn, self.ptable, PRESSURE_INDEXES)
+        update_rollups(conn, self.ptable)
+        update_records(conn, self.ptable)
+        bump_data_version(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+    @property
+    def cube(self):
+        """
+        Cubo de presiones al dia con la version de los datos (engine="cube"),
+        se verifica en cada consulta
+        """
+        return self.get_cube() if self.engine == "cube" else None
+
+    def get_cube(self):
+        cube = pcube.get_cube(self.folder)
+        with cube.lock:
+            version = data_version(self.conn)
+            if not cube.exists() or cube.version != version:
+                ids = [row[0] for row in self.conn.execute(f"SELECT ID FROM {self.ptable}_registros ORDER BY ID")]
+                period = self.conn.execute(f"SELECT MIN(Inicio), MAX(Final) FROM {self.ptable}_registros").fetchone()
+                cube.build(self.storage.blocks(), ids, period, version)
+        return cube
+
+    def get_registry(self):
+        """
+        Registro de estaciones en memoria (station_registry), se recarga solo
+        si cambio la version de estaciones
+        """
+        registry = sreg.get_registry(_key(self.fname))
+        with registry.lock:
+            version = stations_version(self.conn)
+            if registry.table is None or registry.version != version:
+                registry.load(pd.read_sql(f"SELECT * FROM {self.etable}", self.conn), version)
+        return registry
 
     def get_stations_id(self):
-        query = f"SELECT ID FROM {self.etable}"
-        df = pd.read_sql(query, self.conn)["ID"]
-        return [int(x) for x in df]
+        return [int(x) for x in self.get_registry().ids]
 
-    def get_stations(self):
-        query = f"SELECT * FROM {self.etable}"
-        df = pd.read_sql(query, self.conn)
-        return df.set_index("ID", drop=False)
+    def get_stations(self, ids=None):
+        registry = self.get_registry()
+        if ids is None:
+            return registry.frame()
+        return registry.lookup(ids)
 
     def get_station(self, ide=1):
-        query = f"SELECT * FROM {self.etable} WHERE ID = {ide}"
-        df = pd.read_sql(query, self.conn)
-        if len(df) == 1:
-            return df.squeeze()
+        return self.get_registry().station(ide)
+
+    def get_stations_in_bbox(self, xmin, ymin, xmax, ymax):
+        return self.get_registry().in_bbox(xmin, ymin, xmax, ymax)
+
+    def get_stations_in_radius(self, x, y, radius):
+        """
+        Estaciones a menos de radius (km) de la coordenada (x, y)
+        """
+        return self.get_registry().in_radius(x, y, radius)
+
+    def get_nearest_stations(self, x, y, k=1):
+        return self.get_registry().nearest(x, y, k)
+
+    @staticmethod
+    def _window(table, xmin, ymin, xmax, ymax, contained=False):
+        if contained:
+            where = f"{table}.Xmin >= ? AND {table}.Xmax <= ? AND {table}.Ymin >= ? AND {table}.Ymax <= ?"
         else:
-            return pd.Series([], dtype=np.float32)
+            where = f"{table}.Xmax >= ? AND {table}.Xmin <= ? AND {table}.Ymax >= ? AND {table}.Ymin <= ?"
+        return where, (xmin, xmax, ymin, ymax)
+
+    @instrumented
+    @cached_query
+    def get_stations_in_window(self, xmin, ymin, xmax, ymax):
+        """
+        Estaciones dentro de una ventana (vista del mapa o extension de un
+        sector) con el indice R*Tree
+        """
+        where, params = self._window("r", xmin, ymin, xmax, ymax)
+        query = (f"SELECT e.* FROM {self.etable} e JOIN {self.etable}_rtree r ON e.ID = r.ID"
+                 f" WHERE {where} ORDER BY e.ID")
+        df = pd.read_sql(query, self.conn, params=params)
+        return df.set_index("ID", drop=False)
+
+    @instrumented
+    @cached_query
+    def get_grid(self):
+        """
+        Malla de interpolacion (ID, X, Y) con la extension de cada celda
+        """
+        query = ("SELECT m.ID, m.X, m.Y, r.Xmin, r.Xmax, r.Ymin, r.Ymax FROM malla m"
+                 " JOIN malla_rtree r ON m.ID = r.ID ORDER BY m.ID")
+        df = pd.read_sql(query, self.conn)
+        return df.set_index("ID", drop=False)
+
+    @instrumented
+    @cached_query
+    def get_grid_in_window(self, xmin, ymin, xmax, ymax, contained=False):
+        """
+        Celdas de la malla que intersecan la ventana (contained=True: celdas
+        completamente dentro de la ventana)
+        """
+        where, params = self._window("r", xmin, ymin, xmax, ymax, contained)
+        query = (f"SELECT m.ID, m.X, m.Y, r.Xmin, r.Xmax, r.Ymin, r.Ymax FROM malla m"
+                 f" JOIN malla_rtree r ON m.ID = r.ID WHERE {where} ORDER BY m.ID")
+        df = pd.read_sql(query, self.conn, params=params)
+        return df.set_index("ID", drop=False)
         
     def update_stations(self, table):
+        if self.readonly:
+            return False, "La base de datos es de solo lectura."
         if not isinstance(table, pd.DataFrame):
             return False, "No se ha podido cargar la tabla"
         if len(table) == 0:
@@ -114,205 +1431,460 @@ class DataBase:
                 return False, f"La tabla ingresada no tiene la columna '{key}'."
         if len(table["ID"].unique()) != len(table.index):
             return False, "La tabla ingresada tiene índices repetidos para las estaciones."
-        table.to_sql(self.etable, self.conn, if_exists="replace", index=False)
+        # tabla, indice espacial y versiones en una sola transaccion
+        self.conn.execute("BEGIN")
+        try:
+            replace_table(self.conn, table, self.etable)
+            update_stations_index(self.conn, self.etable)
+            bump_data_version(self.conn)
+            bump_stations_version(self.conn)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        query_cache.invalidate(self.fname, data_version(self.conn))
+        self.get_registry()
         return True, "Se ha actualizado la tabla de estaciones."    
         
+    def append_pressures(self, frame):
+        """
+        Agrega o actualiza presiones horarias. frame puede ser ancho (indice de
+        fechas y una columna por estacion) o largo (columnas ID, Fecha y Valor).
+        Los registros existentes con el mismo valor no se reescriben.
+        Los agregados, el periodo de registro y el cubo se actualizan en la
+        misma transaccion.
+        """
+        if self.readonly:
+            return False, "La base de datos es de solo lectura."
+        if not isinstance(frame, pd.DataFrame):
+            return False, "No se ha podido cargar la tabla"
+        if len(frame) == 0:
+            return False, "La tabla ingresada no tiene información"
+        try:
+            if {"ID", "Fecha", "Valor"}.issubset(frame.columns):
+                dates = pd.to_datetime(frame["Fecha"]).values
+                rows = list(pressure_records(frame["ID"].values, dates, frame["Valor"].values))
+            else:
+                frame = frame.loc[~frame.index.duplicated(keep="last"), :]
+                dates = pd.to_datetime(frame.index).values
+                ids = frame.columns.astype(int)
+                rows = list(pressure_rows(dates, ids, frame.to_numpy(dtype=np.float64)))
+        except (ValueError, TypeError):
+            return False, "Error con el formato de la tabla, se requieren fechas, estaciones y presiones."
+        if len(rows) == 0:
+            return True, "No hay registros nuevos."
+        if self.storage.name != "sqlite":
+            return self._append_storage(rows)
+        
+        fields = ", ".join(self.pfields.keys())
+        marks = ", ".join(["?"] * len(self.pfields))
+        query = f"INSERT INTO {self.ptable} ({fields}) VALUES ({marks})"
+        query += " ON CONFLICT (ID, Tiempo) DO UPDATE SET Valor = excluded.Valor"
+        query += " WHERE Valor IS NOT excluded.Valor"
+        self.conn.execute("BEGIN")
+        try:
+            changes = self.conn.total_changes
+            self.conn.executemany(query, rows)
+            changes = self.conn.total_changes - changes
+            if changes > 0:
+                keys = {(row[0], row[3], row[4]) for row in rows}
+                update_rollups(self.conn, self.ptable, keys)
+                update_records(self.conn, self.ptable, {key[0] for key in keys})
+                bump_data_version(self.conn)
+                version = data_version(self.conn)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if changes > 0:
+            query_cache.invalidate(self.fname, version)
+            self._update_cube(rows, version)
+        return True, f"Se agregaron o actualizaron {changes} registros."
+
+    def _append_storage(self, rows):
+        # Almacenamiento Parquet o por bloques: los agregados y el periodo de
+        # registro se calculan con los registros completos de los grupos
+        # (ID, Ano, Mes) modificados. Las particiones Parquet se escriben como
+        # temporales y se reemplazan despues del commit de SQLite; si el
+        # proceso termina entre ambos pasos los agregados incluyen registros
+        # que no estan en los archivos hasta volver a cargar esos meses.
+        frame = pd.DataFrame(rows, columns=list(self.pfields.keys())).loc[:, list(pstore.COLUMNS)]
+        if hasattr(self.storage, "prepare"):
+            try:
+                self.storage.prepare(frame)
+            except ValueError as error:
+                return False, str(error)
+        self.conn.execute("BEGIN")
+        try:
+            changes, groups = self.storage.upsert(frame)
+            if changes > 0:
+                periods = groups.groupby("ID")["Tiempo"].agg(["min", "max"])
+                update_rollups_frame(self.conn, groups, self.ptable)
+                update_records(self.conn, self.ptable, periods=dict(zip(periods.index, periods.values.tolist())))
+                bump_data_version(self.conn)
+                version = data_version(self.conn)
+            self.conn.commit()
+        except ValueError as error:
+            self.conn.rollback()
+            if hasattr(self.storage, "rollback"):
+                self.storage.rollback()
+            return False, str(error)
+        except Exception:
+            self.conn.rollback()
+            if hasattr(self.storage, "rollback"):
+                self.storage.rollback()
+            raise
+        if hasattr(self.storage, "commit"):
+            self.storage.commit()
+        if changes > 0:
+            query_cache.invalidate(self.fname, version)
+            self._update_cube(rows, version)
+        return True, f"Se agregaron o actualizaron {changes} registros."
+
+    def seal_year(self, year):
+        """
+        Cierra un año del almacenamiento anual: su archivo queda de solo
+        lectura y se adjunta con immutable=1. Solo años anteriores al ultimo
+        registro. Falla si otra conexion esta leyendo el año; las demas
+        conexiones lo vuelven a adjuntar en su siguiente consulta.
+        """
+        if self.readonly:
+            return False, "La base de datos es de solo lectura."
+        if self.storage.name != "anual":
+            return False, "Solo se pueden cerrar años del almacenamiento anual."
+        year = int(year)
+        last = self.get_time_period()["max"]
+        if pd.isnull(last) or year >= last.year:
+            return False, f"El año {year} no ha terminado."
+        if year not in self.storage.years():
+            return False, f"No hay registros del año {year}."
+        if self.storage.sealed(year):
+            return True, f"El año {year} ya estaba cerrado."
+        try:
+            self.storage.seal(year)
+        except sqlite3.OperationalError:
+            return False, f"El año {year} está en uso por otra conexión, intenta de nuevo."
+        return True, f"Se cerró el año {year}."
+
+    def _update_cube(self, rows, version):
+        # Escribe los registros nuevos en el cubo si esta al dia, en otro caso
+        # se reconstruye la siguiente vez que se utilice
+        cube = pcube.get_cube(self.folder)
+        with cube.lock:
+            if cube.exists() and cube.version == version - 1:
+                ids, times, values = np.array([(row[0], row[1], row[7]) for row in rows]).T
+                if not cube.write(ids, times, values, version):
+                    # estacion u hora fuera del cubo, se reconstruye en la
+                    # siguiente consulta
+                    cube.invalidate()
+
+    @cached_query
+    def get_metadata(self):
+        """
+        Metadatos de los datos sin recorrer la tabla de presiones: periodo
+        global, periodo y numero de registros por estacion, estaciones y
+        version de los datos.
+        """
+        rows = dict(self.conn.execute("SELECT Clave, Valor FROM metadatos").fetchall())
+        stations = pd.read_sql(
+            f"SELECT ID, Inicio, Final, Registros FROM {self.ptable}_registros ORDER BY ID",
+            self.conn
+        ).set_index("ID")
+        stations["Inicio"] = from_epoch(stations["Inicio"].values)
+        stations["Final"] = from_epoch(stations["Final"].values)
+        return {
+            "periodo": pd.Series(from_epoch([rows.get("tiempo_min"), rows.get("tiempo_max")]), index=["min", "max"]),
+            "registros": stations,
+            "ids": self.get_stations_id(),
+            "version": int(rows.get("version_datos", 0)),
+        }
+
+    @cached_query
     def get_time_period(self):
-        query = f"SELECT MIN(Fecha) AS min, MAX(Fecha) AS max FROM {self.ptable}"
-        df = pd.read_sql(query, self.conn)
-        if len(df) > 0:
-            return pd.to_datetime(df.iloc[0, :])
-        else:
-            return pd.Series([], dtype=np.float32)
+        query = "SELECT Clave, Valor FROM metadatos WHERE Clave IN ('tiempo_min', 'tiempo_max')"
+        rows = dict(self.conn.execute(query).fetchall())
+        return pd.Series(from_epoch([rows.get("tiempo_min"), rows.get("tiempo_max")]), index=["min", "max"])
 
+    @cached_query
     def get_dates_record(self, ide=None, which="both"):
+        table = f"{self.ptable}_registros"
         if which.lower() == "both":
             if ide is not None:
                 ide = int(ide)
-                query = f"SELECT MIN(Fecha) AS min, MAX(Fecha) AS max FROM {self.ptable} WHERE ID = {ide}"
-                df = pd.read_sql(query, self.conn)
-                if len(df) == 1:
-                    return pd.to_datetime(df.iloc[0, :])
+                query = f"SELECT Inicio, Final FROM {table} WHERE ID = {ide}"
+                values = self.conn.execute(query).fetchone() or (None, None)
+                return pd.Series(from_epoch([values[0], values[1]]), index=["min", "max"])
             else:
-                query = f"SELECT ID, MIN(Fecha) AS min, MAX(Fecha) AS max FROM {self.ptable} GROUP BY ID"
+                query = f"SELECT ID, Inicio AS min, Final AS max FROM {table} ORDER BY ID"
                 df = pd.read_sql(query, self.conn)
                 if len(df) > 0:
                     df = df.set_index("ID")
-                    df["max"] = pd.to_datetime(df["max"])
-                    df["min"] = pd.to_datetime(df["min"])
+                    df["max"] = from_epoch(df["max"].values)
+                    df["min"] = from_epoch(df["min"].values)
                     return df
         else:
             which = which.upper()
             if which not in ("MIN", "MAX"):
                 return pd.Series([], dtype=np.float32)
+            field = "Inicio" if which == "MIN" else "Final"
             if ide is not None:
                 ide = int(ide)
-                query = f"SELECT {which}(Fecha) FROM {self.ptable} WHERE ID = {ide}"
-                df = pd.read_sql(query, self.conn)
-                if len(df) == 1:
-                    return pd.to_datetime(df.values[0, 0])
+                query = f"SELECT {field} FROM {table} WHERE ID = {ide}"
+                value = (self.conn.execute(query).fetchone() or (None,))[0]
+                return from_epoch([value])[0]
             else:
-                query = f"SELECT ID, {which}(Fecha) AS {which.lower()} FROM {self.ptable} GROUP BY ID"
+                query = f"SELECT ID, {field} AS {which.lower()} FROM {table} ORDER BY ID"
                 df = pd.read_sql(query, self.conn)
                 if len(df) > 0:
                     df = df.set_index("ID")
-                    return pd.to_datetime(df[which.lower()])
+                    return pd.Series(from_epoch(df[which.lower()].values), index=df.index, name=which.lower())
         return pd.Series([], dtype=np.float32)
 
-    def get_station_pressure(self, ide=1, date=None, year=None, month=None, period=None):
-        ide = int(ide)
-        fields = "Fecha, Valor"
+    @instrumented
+    @cached_query
+    def get_station_pressure(self, ide=1, date=None, year=None, month=None, period=None, max_points=None):
+        """
+        Serie de presiones de una estacion. max_points reduce la serie a la
+        envolvente de a lo mas max_points puntos (downsample_m4) para graficas;
+        los estadisticos se deben calcular con la serie completa.
+        """
+        if max_points is not None:
+            pressure = self.get_station_pressure(ide, date, year, month, period)
+            if len(pressure) <= max_points:
+                return pressure
+            times = pressure.index.values.astype("datetime64[s]").astype(np.int64)
+            return pressure.iloc[downsample_m4(times, pressure.values, max_points)]
+        ids = [int(ide)]
+        fields = ["Tiempo", "Valor"]
+        order = ["Tiempo"]
         if date is not None:
-            dt = pd.Timedelta(1, "minutes")
-            date1 = (pd.to_datetime(date) - dt).strftime("%Y-%m-%d %H:%M")
-            date2 = (pd.to_datetime(date) + dt).strftime("%Y-%m-%d %H:%M")
-            query = f"SELECT {fields} FROM {self.ptable} WHERE ID = {ide} AND Fecha BETWEEN '{date1}' AND '{date2}'"
+            time = to_epoch(date)
+            df = self.storage.read(fields, ids, time=(time - 60, time + 60), order=order)
         elif type(period) in (tuple, list):
-            dt = pd.Timedelta(30, "minutes")
-            date1 = (pd.to_datetime(period[0]) - dt).strftime("%Y-%m-%d %H:%M")
-            date2 = (pd.to_datetime(period[1]) + dt).strftime("%Y-%m-%d %H:%M")
-            query = f"SELECT {fields} FROM {self.ptable} WHERE ID = {ide} AND Fecha BETWEEN '{date1}' AND '{date2}'"
+            time1 = to_epoch(period[0]) - 1800
+            time2 = to_epoch(period[1]) + 1800
+            df = self.storage.read(fields, ids, time=(time1, time2), order=order)
         elif year is not None and month is not None:
-            query = f"SELECT {fields} FROM {self.ptable} WHERE ID = {ide} AND Ano = {int(year)} AND Mes = {int(month)} ORDER BY Fecha"
+            df = self.storage.read(fields, ids, year=year, month=month, order=order)
         elif month is not None:
-            query = f"SELECT {fields} FROM {self.ptable} WHERE ID = {ide} AND Mes = {int(month)} ORDER BY Fecha"
+            df = self.storage.read(fields, ids, month=month, order=order)
         else:
-            query = f"SELECT {fields} FROM {self.ptable} WHERE ID = {ide} ORDER BY Fecha"
-        df = pd.read_sql(query, self.conn)
+            df = self.storage.read(fields, ids, order=order)
         if len(df) > 0:
-            df["Fecha"] = pd.to_datetime(df["Fecha"])
-            return df.set_index("Fecha")["Valor"]
+            index = from_epoch(df["Tiempo"].values).rename("Fecha")
+            return pd.Series(df["Valor"].values, index=index, name="Valor")
         else:
             return pd.Series([], dtype=np.float32)
     
-    def get_hourly_pressure(self, date, hour, ide=None):
-        date1 = pd.to_datetime(date)
-        year = date1.year
-        month = date1.month
-        day = date1.day
-        query_date = f"Ano = {year} AND Mes = {month} AND Dia = {day} AND Hora = {hour}"
+    def iter_station_pressure(self, ide=1, period=None, chunk="30D"):
+        """
+        Serie de presiones de una estacion por intervalos de tiempo de duracion
+        chunk (Timedelta o texto como "30D"), igual que get_station_pressure,
+        para recorrer historias completas con memoria acotada. Sin period
+        recorre todo el registro de la estacion. Se debe terminar de recorrer
+        antes de cerrar la base de datos.
+        """
+        for df in self._iter_chunks(["Tiempo", "Valor"], [int(ide)], period, chunk):
+            index = from_epoch(df["Tiempo"].values).rename("Fecha")
+            yield pd.Series(df["Valor"].values, index=index, name="Valor")
+
+    def iter_pressures(self, ide=None, period=None, chunk="7D"):
+        """
+        Igual que iter_station_pressure para varias estaciones (None: todas).
+        Cada intervalo es un DataFrame largo con columnas ID, Fecha y Valor
+        ordenado por fecha y estacion (formato de append_pressures).
+        """
+        for df in self._iter_chunks(["ID", "Tiempo", "Valor"], self._id_list(ide), period, chunk):
+            yield pd.DataFrame({
+                "ID": df["ID"].values,
+                "Fecha": from_epoch(df["Tiempo"].values),
+                "Valor": df["Valor"].values,
+            })
+
+    def _iter_chunks(self, columns, ids, period, chunk):
+        step = int(pd.Timedelta(chunk).total_seconds())
+        if type(period) in (tuple, list):
+            time = (to_epoch(period[0]), to_epoch(period[1]))
+        else:
+            query = f"SELECT MIN(Inicio), MAX(Final) FROM {self.ptable}_registros"
+            if ids is not None:
+                query += f" WHERE ID IN ({', '.join([str(x) for x in ids])})"
+            time = self.conn.execute(query).fetchone()
+            if time[0] is None:
+                return iter(())
+            # intervalos desde el inicio del dia del primer registro
+            time = (time[0] - time[0] % 86400, time[1])
+        return self.storage.iter_read(columns, ids, time, step)
+
+    @staticmethod
+    def _id_list(ide):
         if type(ide) in (int, float, str):
-            ide = int(ide)
-            query = f"SELECT ID, Valor FROM {self.ptable} WHERE ID = {ide} AND {query_date}"
+            return [int(ide)]
         elif type(ide) in (tuple, list, np.ndarray):
-            ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Valor FROM {self.ptable} WHERE ID IN ({ids}) AND {query_date}"
-        else:
-            query = f"SELECT ID, Valor FROM {self.ptable} WHERE {query_date}"
-        df = pd.read_sql(query, self.conn)
+            return [int(x) for x in ide]
+        return None
+
+    @instrumented
+    @cached_query
+    def get_hourly_pressure(self, date, hour, ide=None):
+        cube = self.cube
+        if cube is not None:
+            time = to_epoch(pd.to_datetime(date).normalize()) + int(hour) * 3600
+            ids, values = cube.gather(time, self._id_list(ide))
+            if len(ids) == 0:
+                return pd.DataFrame([], columns=["ID", "Valor"])
+            return pd.DataFrame({"Valor": values}, index=pd.Index(ids, name="ID"))
+        date1 = pd.to_datetime(date)
+        df = self.storage.read(
+            ["ID", "Valor"], self._id_list(ide), year=date1.year, month=date1.month,
+            day=date1.day, hour=hour, order=["ID"]
+        )
         if len(df) > 0:
             df.set_index("ID", inplace=True)
         return df
 
+    @instrumented
+    @cached_query
     def get_pressure_by_day(self, date, ide=None):
-        dt1 = pd.Timedelta(30, "minutes")
-        dt2 = pd.Timedelta(23, "hours")
-        day = pd.to_datetime(date).strftime("%Y-%m-%d")
-        date1 = (pd.to_datetime(day) - dt1).strftime("%Y-%m-%d %H:%M")
-        date2 = (pd.to_datetime(day) + dt1 + dt2).strftime("%Y-%m-%d %H:%M")
+        day = to_epoch(pd.to_datetime(date).normalize())
+        cube = self.cube
+        if cube is not None:
+            return self._cube_day(cube, day, ide)
+        time = (day - 1800, day + 23 * 3600 + 1800)
         if type(ide) in (int, float, str):
-            ide = int(ide)
-            query = f"SELECT Hora, Valor FROM {self.ptable} WHERE ID = {ide} AND Fecha BETWEEN '{date1}' AND '{date2}'"
-            df = pd.read_sql(query, self.conn)
+            df = self.storage.read(["Hora", "Valor"], [int(ide)], time=time, order=["Tiempo"])
             if len(df) > 0:
                 return df.set_index("Hora")["Valor"]
             else:
                 return pd.Series([], dtype=np.float32)
-        elif type(ide) in (tuple, list, np.ndarray):
-            ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Hora, Valor FROM {self.ptable} WHERE ID IN ({ids}) AND Fecha BETWEEN '{date1}' AND '{date2}'"        
-        else:
-            query = f"SELECT ID, Hora, Valor FROM {self.ptable} WHERE Fecha BETWEEN '{date1}' AND '{date2}'"
-        df = pd.read_sql(query, self.conn)
+        df = self.storage.read(["ID", "Hora", "Valor"], self._id_list(ide), time=time)
         if len(df) > 0:
             return pd.pivot_table(df, values="Valor", index="Hora", columns="ID")
         else:
             return pd.DataFrame([], dtype=np.float32)
     
-    def get_hourly_pressure_by_month(self, year, month, ide=None):
-        if type(ide) in (int, float, str):
-            ide = int(ide)
-            query = "SELECT Hora, MIN(Valor) AS min, AVG(Valor) AS mean, MAX(Valor) AS max"
-            query += f" FROM {self.ptable} WHERE ID = {ide} AND Ano = {year} AND Mes = {month}"
-            query += " GROUP BY Hora"
-            df = pd.read_sql(query, self.conn)
-            if len(df) > 0:
-                return df.set_index("Hora")
-            else:
-                return pd.Series([], dtype=np.float32)
-        elif type(ide) in (tuple, list, np.ndarray):
-            ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Hora, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE ID IN ({ids}) AND Ano = {year} AND Mes = {month}"
-            query += " GROUP BY ID, Hora"
-        else:
-            query = f"SELECT ID, Hora, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE Ano = {year} AND Mes = {month}"
-            query += " GROUP BY ID, Hora"
-        df = pd.read_sql(query, self.conn)
-        if len(df) > 0:
-            return pd.pivot_table(df, values="mean", index="Hora", columns="ID")
+    @instrumented
+    @cached_query
+    def get_pressure_matrix(self, period=None, year=None, month=None, ide=None):
+        """
+        Presiones horarias de varias estaciones en una sola consulta, como
+        matriz [fecha, estacion] con indice horario completo del periodo
+        (period=(fecha1, fecha2), año y mes, o solo año). Las horas sin
+        registro son NaN y se omiten las estaciones sin registros.
+        """
+        if type(period) in (tuple, list):
+            date1 = pd.to_datetime(period[0]).floor("1H")
+            date2 = pd.to_datetime(period[1]).floor("1H")
+        elif year is not None and month is not None:
+            date1 = pd.Timestamp(int(year), int(month), 1)
+            date2 = date1 + pd.offsets.MonthBegin(1) - pd.Timedelta(1, "hours")
+        elif year is not None:
+            date1 = pd.Timestamp(int(year), 1, 1)
+            date2 = pd.Timestamp(int(year), 12, 31, 23)
         else:
             return pd.DataFrame([], dtype=np.float32)
+        dates = pd.date_range(date1, date2, freq="1H", name="Fecha")
+        time1 = to_epoch(date1)
+        ids = self._id_list(ide)
         
-    def get_daily_pressure_by_month(self, year, month, ide=None):
-        if type(ide) in (int, float, str):
-            ide = int(ide)
-            query = "SELECT Dia, MIN(Valor) AS min, AVG(Valor) AS mean, MAX(Valor) AS max"
-            query += f" FROM {self.ptable} WHERE ID = {ide} AND Ano = {year} AND Mes = {month}"
-            query += " GROUP BY Dia"
-            df = pd.read_sql(query, self.conn)
-            if len(df) > 0:
-                return df.set_index("Dia")
+        cube = self.cube
+        if cube is not None:
+            hours, ids, block = cube.window(time1, len(dates), ids)
+            values = np.full((len(dates), len(ids)), np.nan)
+            values[hours, :] = block
+        else:
+            df = self.storage.read(["ID", "Tiempo", "Valor"], ids, time=(time1, time1 + len(dates) * 3600 - 1))
+            if len(df) == 0:
+                return pd.DataFrame([], dtype=np.float32)
+            rows = df.to_numpy(dtype=np.float64)
+            found = np.unique(rows[:, 0].astype(np.int64))
+            if ids is None:
+                ids = found
             else:
+                found = set(found.tolist())
+                ids = np.array([x for x in ids if x in found], dtype=np.int64)
+            order = np.argsort(ids)
+            cols = order[np.searchsorted(ids, rows[:, 0].astype(np.int64), sorter=order)]
+            hours = (rows[:, 1].astype(np.int64) - time1) // 3600
+            # promedio horario (equivale a resample("1H").mean())
+            cells = hours * len(ids) + cols
+            size = len(dates) * len(ids)
+            counts = np.bincount(cells, minlength=size)
+            sums = np.bincount(cells, weights=rows[:, 2], minlength=size)
+            with np.errstate(invalid="ignore"):
+                values = (sums / counts).reshape(len(dates), len(ids))
+        
+        mask = ~np.isnan(values).all(axis=0)
+        if not mask.any():
+            return pd.DataFrame([], dtype=np.float32)
+        return pd.DataFrame(values[:, mask], index=dates, columns=pd.Index(np.asarray(ids)[mask], name="ID"))
+
+    def _cube_day(self, cube, day, ide=None):
+        hours, ids, block = cube.window(day, 24, self._id_list(ide))
+        valid = ~np.isnan(block)
+        rows, cols = valid.any(axis=1), valid.any(axis=0)
+        if type(ide) in (int, float, str):
+            if len(ids) == 0 or not rows.any():
                 return pd.Series([], dtype=np.float32)
-        elif type(ide) in (tuple, list, np.ndarray):
-            ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Dia, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE ID IN ({ids}) AND Ano = {year} AND Mes = {month}"
-            query += " GROUP BY ID, Dia"
-        else:
-            query = f"SELECT ID, Dia, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE Ano = {year} AND Mes = {month}"
-            query += " GROUP BY ID, Dia"
-        df = pd.read_sql(query, self.conn)
-        if len(df) > 0:
-            return pd.pivot_table(df, values="mean", index="Dia", columns="ID")
-        else:
+            return pd.Series(block[rows, 0], index=pd.Index(hours[rows], name="Hora"), name="Valor")
+        if not rows.any():
             return pd.DataFrame([], dtype=np.float32)
+        if not (rows.all() and cols.all()):
+            hours, ids, block = hours[rows], ids[cols], block[rows][:, cols]
+        return pd.DataFrame(block, index=pd.Index(hours, name="Hora"),
+                            columns=pd.Index(ids, name="ID"), copy=False)
 
-    def get_monthly_pressure_by_year(self, year, ide=None):
+    def _rollup_stats(self, suffix, column, where, ide=None):
+        # Estadisticos desde las tablas agregadas: min/mean/max de una estacion
+        # o promedios de varias estaciones con una columna por estacion
+        table = f"{self.ptable}_{suffix}"
         if type(ide) in (int, float, str):
             ide = int(ide)
-            query = "SELECT Mes, MIN(Valor) AS min, AVG(Valor) AS mean, MAX(Valor) AS max"
-            query += f" FROM {self.ptable} WHERE ID = {ide} AND Ano = {year}"
-            query += " GROUP BY Mes"
+            query = f"SELECT {column}, Minimo AS min, Suma * 1.0 / Registros AS mean, Maximo AS max"
+            query += f" FROM {table} WHERE ID = {ide} AND {where}"
+            query += f" ORDER BY {column}"
             df = pd.read_sql(query, self.conn)
             if len(df) > 0:
-                return df.set_index("Mes")
+                return df.set_index(column)
             else:
                 return pd.Series([], dtype=np.float32)
         elif type(ide) in (tuple, list, np.ndarray):
             ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Mes, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE ID IN ({ids}) AND Ano = {year}"
-            query += " GROUP BY ID, Mes"
+            query = f"SELECT ID, {column}, Suma * 1.0 / Registros AS mean FROM {table}"
+            query += f" WHERE ID IN ({ids}) AND {where}"
         else:
-            query = f"SELECT ID, Mes, AVG(Valor) AS mean FROM {self.ptable}"
-            query += f" WHERE Ano = {year}"
-            query += " GROUP BY ID, Mes"
+            query = f"SELECT ID, {column}, Suma * 1.0 / Registros AS mean FROM {table}"
+            query += f" WHERE {where}"
         df = pd.read_sql(query, self.conn)
         if len(df) > 0:
-            return pd.pivot_table(df, values="mean", index="Mes", columns="ID")
+            return pd.pivot_table(df, values="mean", index=column, columns="ID")
         else:
             return pd.DataFrame([], dtype=np.float32)
+
+    @instrumented
+    @cached_query
+    def get_hourly_pressure_by_month(self, year, month, ide=None):
+        return self._rollup_stats("hora", "Hora", f"Ano = {int(year)} AND Mes = {int(month)}", ide)
+        
+    @instrumented
+    @cached_query
+    def get_daily_pressure_by_month(self, year, month, ide=None):
+        return self._rollup_stats("dia", "Dia", f"Ano = {int(year)} AND Mes = {int(month)}", ide)
+
+    @instrumented
+    @cached_query
+    def get_monthly_pressure_by_year(self, year, ide=None):
+        return self._rollup_stats("mes", "Mes", f"Ano = {int(year)}", ide)
         
+    @instrumented
+    @cached_query
     def get_monthly_records_by_year(self, year, ide=None):
+        table = f"{self.ptable}_mes"
         if type(ide) in (int, float, str):
             ide = int(ide)
-            query = "SELECT Mes, COUNT(Valor) AS count FROM {self.ptable}"
-            query += f" WHERE ID = {ide} AND Ano = {year}"
-            query += " GROUP BY Mes"
+            query = f"SELECT Mes, Registros AS count FROM {table}"
+            query += f" WHERE ID = {ide} AND Ano = {int(year)}"
+            query += " ORDER BY Mes"
             df = pd.read_sql(query, self.conn)
             if len(df) > 0:
                 return df.set_index("Mes")
@@ -320,30 +1892,51 @@ class DataBase:
                 return pd.Series([], dtype=np.float32)
         elif type(ide) in (tuple, list, np.ndarray):
             ids = ", ".join([str(x) for x in ide])
-            query = f"SELECT ID, Mes, COUNT(Valor) AS count FROM {self.ptable}"
-            query += f" WHERE ID IN ({ids}) AND Ano = {year}"
-            query += " GROUP BY ID, Mes"
+            query = f"SELECT ID, Mes, Registros AS count FROM {table}"
+            query += f" WHERE ID IN ({ids}) AND Ano = {int(year)}"
         else:
-            query = f"SELECT ID, Mes, COUNT(Valor) AS count FROM {self.ptable}"
-            query += f" WHERE Ano = {year}"
-            query += " GROUP BY ID, Mes"
+            query = f"SELECT ID, Mes, Registros AS count FROM {table}"
+            query += f" WHERE Ano = {int(year)}"
         df = pd.read_sql(query, self.conn)
         if len(df) > 0:
             return pd.pivot_table(df, values="count", index="Mes", columns="ID")
         else:
             return pd.DataFrame([], dtype=np.float32)
 
+    @instrumented
+    def get_month_signature(self, year, month, ide=None):
+        """
+        Firma de los registros de un mes a partir de los agregados mensuales,
+        cambia cuando se agregan o modifican presiones del mes
+        """
+        query = (f"SELECT COUNT(*), TOTAL(Registros), TOTAL(Suma), MIN(Minimo), MAX(Maximo)"
+                 f" FROM {self.ptable}_mes WHERE Ano = {int(year)} AND Mes = {int(month)}")
+        ids = self._id_list(ide)
+        if ids is not None:
+            query += f" AND ID IN ({', '.join([str(x) for x in ids])})"
+        return "|".join(str(x) for x in self.conn.execute(query).fetchone())
+
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            if self.storage.name == "anual":
+                # las conexiones libres no conservan años adjuntos, asi un
+                # año se puede cerrar sin esperar a que se cierre el pool
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                try:
+                    self.storage.detach()
+                except sqlite3.OperationalError:
+                    pass
+            self.pool.release(self.conn)
+            self.conn = None
 
 
 #%% Base de datos de rangos de presiones
 
 class PresionesRangosDB:
     
-    def __init__(self):
-        self.folder = os.path.join(path, "Datos")
-        self.fname = os.path.join(path, "Datos", "RangosPresiones.sqlite")
+    def __init__(self, readonly=False, location=None):
+        self.fname, self.folder, fixed = resolve_location(location, os.path.join(path, "Datos", "RangosPresiones.sqlite"))
         
         self.prtable = "rangos"
         self.prfields = {
@@ -353,20 +1946,36 @@ class PresionesRangosDB:
             "MaxPresion": "float NOT NULL",  # presion minima
         }
         
-        self.init_db()
+        # init_db agrega la tabla por defecto aun si se abre de solo lectura
+        self.readonly = False
+        if not fixed:
+            _initialize_once(self.fname, self.init_db)
+        self.readonly = readonly or fixed
+        self.pool = get_pool(self.fname, self.readonly)
+        self.conn = self.pool.acquire()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
     
     def init_db(self):
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
-        if not os.path.exists(self.fname):
-            self.conn = sqlite3.connect(self.fname)
-            cursor = self.conn.cursor()
-            fieldstr = ", ".join([f"{key} {value}" for key, value in self.prfields.items()])
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.prtable} ({fieldstr})")
-            self.conn.commit()
-            self.add_default_table()
+        pool = get_pool(self.fname)
+        self.conn = pool.acquire()
+        if _table_exists(self.conn, self.prtable):
+            pool.release(self.conn)
         else:
-            self.conn = sqlite3.connect(self.fname)
+            try:
+                cursor = self.conn.cursor()
+                fieldstr = ", ".join([f"{key} {value}" for key, value in self.prfields.items()])
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.prtable} ({fieldstr})")
+                self.conn.commit()
+                self.add_default_table()
+            finally:
+                pool.release(self.conn)
             
     def check_if_exists(self, clave):
         query = f"SELECT COUNT(*) AS count FROM {self.prtable} WHERE Clave = '{clave}'"
@@ -374,6 +1983,8 @@ class PresionesRangosDB:
         return bool(cursor.execute(query).fetchone()[0])
             
     def add_ranges_table(self, clave, table):
+        if self.readonly:
+            return False, "La base de datos es de solo lectura."
         if self.check_if_exists(clave):
             return False, "Ya existe una tabla con esa clave"
         # check for columns
@@ -393,6 +2004,8 @@ class PresionesRangosDB:
         self.add_ranges_table("Constantes", table)
         
     def delete_table(self, clave: str):
+        if self.readonly:
+            return False, "La base de datos es de solo lectura."
         if clave == "Constante":
             return False, "No se puede eliminar la tabla por defecto."
         if not self.check_if_exists(clave):
@@ -412,6 +2025,7 @@ class PresionesRangosDB:
             claves = claves.to_list()
         return claves
     
+    @instrumented
     def get_pressure_ranges(self, clave, ids=None):
         if not self.check_if_exists(clave):
             return pd.Series([np.nan, np.nan], index=["MinPresion", "MaxPresion"])
@@ -455,6 +2069,8 @@ class PresionesRangosDB:
         return True, "Tabla cargada de forma correcta"
         
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            self.pool.release(self.conn)
+            self.conn = None
 
 
@@ -25,24 +25,21 @@ path = os.path.dirname(os.path.abspath(__file__))
 ranges_table = pd.read_csv(os.path.join(os.path.dirname(path), "DatosIniciales", "RangosPresiones_variables.csv"))
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        ids = db.get_stations_id()
     st.session_state["ids"] = ids
 
 #%% Definir funciones
 
 def get_staion_data(ide):
-    db = dbs.DataBase()
-    data = db.get_station(int(ide))
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        data = db.get_station(int(ide))
     return data
 
 
 def get_pressure_ranges(clave, ide):
-    pbd = dbs.PresionesRangosDB()
-    pressure_ranges = pbd.get_pressure_ranges(clave, ids=int(ide))
-    pbd.close()
+    with dbs.PresionesRangosDB(readonly=True) as pbd:
+        pressure_ranges = pbd.get_pressure_ranges(clave, ids=int(ide))
     return pressure_ranges
 
 
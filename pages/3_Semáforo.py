@@ -22,18 +22,15 @@ import pressure_ranges as poperation
 #%% Datos iniciales
 PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-db = dbs.DataBase()
-dates = db.get_time_period()
-date1 = dates["min"].to_pydatetime().date()
-date2 = dates["max"].to_pydatetime().date()
-hour2 = dates["max"].hour
-db.close()
+with dbs.DataBase(readonly=True) as db:
+    metadata = db.get_metadata()
+    dates = metadata["periodo"]
+    date1 = dates["min"].to_pydatetime().date()
+    date2 = dates["max"].to_pydatetime().date()
+    hour2 = dates["max"].hour
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
-    st.session_state["ids"] = ids
+    st.session_state["ids"] = metadata["ids"]
 
 
 #%% Funciones
@@ -61,10 +58,9 @@ if "network_layer" not in st.session_state:
 def query_pressures2(date, hour, ids):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    stations = db.get_stations()
-    pressure = db.get_hourly_pressure(date, hour, ids)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        stations = db.get_stations()
+        pressure = db.get_hourly_pressure(date, hour, ids)
     if len(pressure) == 0:
         return [], 0, {}
     
@@ -192,7 +188,7 @@ if flag == 0:
 
 else:
     if ranges_option2 == "Variables":
-        ranges_table = pd.read_csv(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
+        ranges_table = poperation.get_ranges(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
         table, operation, color_sequence = poperation.stations_operation(table, date2, hour2, ranges_table)
 
     elif ranges_option2 == "Recomendado":
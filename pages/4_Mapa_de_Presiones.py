@@ -22,18 +22,15 @@ import interpolation as intp
 #%% Datos iniciales
 PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-db = dbs.DataBase()
-dates = db.get_time_period()
-date1 = dates["min"].to_pydatetime().date()
-date2 = dates["max"].to_pydatetime().date()
-hour2 = dates["max"].hour
-db.close()
+with dbs.DataBase(readonly=True) as db:
+    metadata = db.get_metadata()
+    dates = metadata["periodo"]
+    date1 = dates["min"].to_pydatetime().date()
+    date2 = dates["max"].to_pydatetime().date()
+    hour2 = dates["max"].hour
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
-    st.session_state["ids"] = ids
+    st.session_state["ids"] = metadata["ids"]
 
 
 #%% Funciones
@@ -61,10 +58,9 @@ if "network_layer" not in st.session_state:
 def query_map_pressures(date, hour, ids):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    stations = db.get_stations()
-    pressure = db.get_hourly_pressure(date, hour, ids)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        stations = db.get_stations()
+        pressure = db.get_hourly_pressure(date, hour, ids)
     if len(pressure) == 0:
         return [], 0
     stations = stations.loc[:, ["ID", "Nombre", "X", "Y", "Diametro", "Carga", "Instalacion"]]
@@ -139,8 +135,8 @@ def plot_interp_pressure_map(data, basemap, show_sectors=False, sectors_color="#
     with open(os.path.join(PATH, "Datos", "Malla.geojson")) as fid:
         layer = json.load(fid)
     
-    grid_table = pd.read_csv(os.path.join(PATH, "Datos", "MallaCoordenadas.csv"))
-    grid_table.set_index("ID", drop=False, inplace=True)
+    with dbs.DataBase(readonly=True) as db:
+        grid_table = db.get_grid()[["ID", "X", "Y"]].copy()
     
     grid_table = intp.idw_interpolation(data, grid_table)
     grid_table = grid_table[["ID", "Presion (km/cm2)"]]
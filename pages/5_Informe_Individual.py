@@ -22,32 +22,33 @@ import pressure_ranges as poperation
 #%% Datos iniciales
 PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-db = dbs.DataBase()
-dates = db.get_time_period()
-date0 = dates["min"].to_pydatetime().date()
-date1 = (dates["max"] - pd.Timedelta(60, "days")).to_pydatetime().date()
-date2 = dates["max"].to_pydatetime().date()
-db.close()
+with dbs.DataBase(readonly=True) as db:
+    metadata = db.get_metadata()
+    dates = metadata["periodo"]
+    date0 = dates["min"].to_pydatetime().date()
+    date1 = (dates["max"] - pd.Timedelta(60, "days")).to_pydatetime().date()
+    date2 = dates["max"].to_pydatetime().date()
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
-    st.session_state["ids"] = ids
+    st.session_state["ids"] = metadata["ids"]
 
 
-ranges_table = pd.read_csv(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
+ranges_table = poperation.get_ranges(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
+
+# Puntos maximos de la grafica de serie temporal
+MAX_POINTS = 4000
 
 
 #%% Definir funciones
 
 def temporal_serie(ide, date1, date2):
-    db = dbs.DataBase()
-    date1 = pd.to_datetime(date1) - pd.Timedelta(30, "minutes")
-    date2 = pd.to_datetime(date2) + pd.Timedelta(30, "minutes") + pd.Timedelta(23, "hours")
-    pressure = db.get_station_pressure(ide=ide, period=(date1, date2))
-    station = db.get_station(ide)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        date1 = pd.to_datetime(date1) - pd.Timedelta(30, "minutes")
+        date2 = pd.to_datetime(date2) + pd.Timedelta(30, "minutes") + pd.Timedelta(23, "hours")
+        pressure = db.get_station_pressure(ide=ide, period=(date1, date2))
+        # la grafica utiliza la envolvente de la serie, los estadisticos la serie completa
+        pressure_plot = db.get_station_pressure(ide=ide, period=(date1, date2), max_points=MAX_POINTS)
+        station = db.get_station(ide)
     if len(pressure) == 0:
         name = ""
         stats = pd.DataFrame([])
@@ -56,14 +57,13 @@ def temporal_serie(ide, date1, date2):
         stats = pressure.groupby(pressure.index.hour).agg(["min", "mean", "max"])
         stats.columns = ["Presion Min", "Presion Promedio", "Presion Max"]
         stats.index.rename("Hora", inplace=True)
-    return pressure, stats, name
+    return pressure, pressure_plot, stats, name
 
 
 def daily_pressure(ide, date):
-    db = dbs.DataBase()
-    pressure = db.get_pressure_by_day(date, ide)
-    station = db.get_station(ide)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_pressure_by_day(date, ide)
+        station = db.get_station(ide)
     if len(pressure) == 0:
         name = ""
         stats = pd.DataFrame([])
@@ -75,10 +75,9 @@ def daily_pressure(ide, date):
 
 
 def hourly_pressure_by_month(ide, year, month):
-    db = dbs.DataBase()
-    pressure = db.get_hourly_pressure_by_month(year, month, ide)
-    station = db.get_station(ide)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_hourly_pressure_by_month(year, month, ide)
+        station = db.get_station(ide)
     name = station["Nombre"]
     if len(pressure) > 0:
         pressure.columns = ["Presion Min", "Presion Promedio", "Presion Max"]
@@ -86,10 +85,9 @@ def hourly_pressure_by_month(ide, year, month):
 
 
 def daily_pressure_by_month(ide, year, month):
-    db = dbs.DataBase()
-    pressure = db.get_daily_pressure_by_month(year, month, ide)
-    station = db.get_station(ide)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_daily_pressure_by_month(year, month, ide)
+        station = db.get_station(ide)
     name = station["Nombre"]
     if len(pressure) > 0:
         pressure.columns = ["Presion Min", "Presion Promedio", "Presion Max"]
@@ -97,10 +95,9 @@ def daily_pressure_by_month(ide, year, month):
 
 
 def monthly_pressure_by_year(ide, year):
-    db = dbs.DataBase()
-    pressure = db.get_monthly_pressure_by_year(year, ide)
-    station = db.get_station(ide)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_monthly_pressure_by_year(year, ide)
+        station = db.get_station(ide)
     name = station["Nombre"]
     if len(pressure) > 0:
         pressure.columns = ["Presion Min", "Presion Promedio", "Presion Max"]
@@ -143,7 +140,7 @@ if plot_type == "Serie temporal":
         max_value=date2
     )
     
-    pressure, stats, name = temporal_serie(selection, sdate1, sdate2)
+    pressure, pressure_plot, stats, name = temporal_serie(selection, sdate1, sdate2)
     
     if len(pressure) == 0:
         st.error(f"No se encontraron registros de la estación **{selection}-{name}** para el periodo **{sdate1}** a **{sdate2}**")
@@ -151,8 +148,8 @@ if plot_type == "Serie temporal":
         # plot
         data_plot = [
             go.Scatter(
-                x=pressure.index,
-                y=pressure,
+                x=pressure_plot.index,
+                y=pressure_plot,
                 mode="lines",
                 marker_color="rgba(31, 60, 144, 0.8)"
             )
@@ -19,18 +19,15 @@ import data_bases as dbs
 
 
 #%% Datos iniciales
-db = dbs.DataBase()
-dates = db.get_time_period()
-date0 = dates["min"].to_pydatetime().date()
-date1 = (dates["max"] - pd.Timedelta(60, "days")).to_pydatetime().date()
-date2 = dates["max"].to_pydatetime().date()
-db.close()
+with dbs.DataBase(readonly=True) as db:
+    metadata = db.get_metadata()
+    dates = metadata["periodo"]
+    date0 = dates["min"].to_pydatetime().date()
+    date1 = (dates["max"] - pd.Timedelta(60, "days")).to_pydatetime().date()
+    date2 = dates["max"].to_pydatetime().date()
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
-    st.session_state["ids"] = ids
+    st.session_state["ids"] = metadata["ids"]
 
 
 #%% Definir funciones
@@ -38,10 +35,9 @@ if "ids" not in st.session_state:
 def daily_pressure(ids, date):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    stations = db.get_stations()
-    pressure = db.get_pressure_by_day(date, ids).round(3)
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        stations = db.get_stations()
+        pressure = db.get_pressure_by_day(date, ids).round(3)
     if ids is None:
         ids = []  # ids comunes
         for i in stations["ID"]:
@@ -72,10 +68,9 @@ def daily_pressure(ids, date):
 def hourly_pressure_by_month(ids, year, month):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    pressure = db.get_hourly_pressure_by_month(year, month, ids)
-    stations = db.get_stations()
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_hourly_pressure_by_month(year, month, ids)
+        stations = db.get_stations()
     if ids is None:
         ids = []  # ids comunes
         for i in stations["ID"]:
@@ -101,10 +96,9 @@ def hourly_pressure_by_month(ids, year, month):
 def daily_pressure_by_month(ids, year, month):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    pressure = db.get_daily_pressure_by_month(year, month, ids)
-    stations = db.get_stations()
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_daily_pressure_by_month(year, month, ids)
+        stations = db.get_stations()
     if ids is None:
         ids = []  # ids comunes
         for i in stations["ID"]:
@@ -130,10 +124,9 @@ def daily_pressure_by_month(ids, year, month):
 def monthly_pressure_by_year(ids, year):
     if len(ids) == 0:
         ids = None
-    db = dbs.DataBase()
-    pressure = db.get_monthly_pressure_by_year(year, ids)
-    stations = db.get_stations()
-    db.close()
+    with dbs.DataBase(readonly=True) as db:
+        pressure = db.get_monthly_pressure_by_year(year, ids)
+        stations = db.get_stations()
     if ids is None:
         ids = []  # ids comunes
         for i in stations["ID"]:
@@ -2,13 +2,10 @@
 
 #%% Libraries
 import os
-import json
-import datetime
+import zlib
+import toml
 import numpy as np
-import pandas as pd
-from calendar import monthrange
 import plotly.express as px
-import plotly.graph_objects as go
 import streamlit as st
 
 import data_bases as dbs
@@ -18,45 +15,59 @@ import pressure_ranges as poperation
 #%% Datos iniciales
 PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-db = dbs.DataBase()
-dates = db.get_time_period()
-date1 = dates["min"].to_pydatetime().date()
-date2 = dates["max"].to_pydatetime().date()
-hour2 = dates["max"].hour
-db.close()
+config = toml.load(os.path.join(PATH, "config.toml"))
+# Procesos para calcular los meses del reporte (1: sin procesos en paralelo)
+WORKERS = int(config.get("operacion", {}).get("Procesos", 1))
+
+with dbs.DataBase(readonly=True) as db:
+    metadata = db.get_metadata()
+    dates = metadata["periodo"]
+    date1 = dates["min"].to_pydatetime().date()
+    date2 = dates["max"].to_pydatetime().date()
+    hour2 = dates["max"].hour
 
 if "ids" not in st.session_state:
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    db.close()
-    st.session_state["ids"] = ids
+    st.session_state["ids"] = metadata["ids"]
 
 
 def operational_hourly_pressure(year, month):
-    
-    days = monthrange(year, month)[1]
-    db = dbs.DataBase()
-    ids = db.get_stations_id()
-    stations = db.get_stations()
-    pressure = []
-    for ide in ids:
-        p = db.get_station_pressure(ide=ide, year=year, month=month)
-        p.index = pd.to_datetime(p.index)
-        p = p.resample("1H").mean()
-        pressure.append(p)
-    db.close()
-    
-    pressure_frame = pd.concat(pressure, axis=1)
-    pressure_frame.columns = ids
-    
-    ids = []  # ids comunes
-    for i in stations["ID"]:
-        if i in pressure_frame.columns:
-            ids.append(i)
-    stations = stations.loc[ids, :]    
-    pressure_frame = pressure_frame.loc[:, ids]
-    
-    return pressure_frame.dropna(axis=1, how="all")
+    with dbs.DataBase(readonly=True) as db:
+        stations = db.get_stations()
+        pressure_frame = db.get_pressure_matrix(year=year, month=month, ide=stations["ID"].values)
+    return pressure_frame
+
+
+def operation_partials(months, ranges_table):
+    """
+    Parciales mensuales del reporte desde la cache; solo se calculan los
+    meses con datos nuevos (en paralelo con WORKERS procesos) y los meses
+    anteriores al ultimo mes con registros se guardan en Datos/Operacion.
+    En los meses frontera de los rangos variables solo aplica la temporada
+    que inicia en el mes (ver pressure_ranges.operation_partial)
+    """
+    with dbs.DataBase(readonly=True) as db:
+        ids = db.get_stations()["ID"].values
+        stations = str(zlib.crc32(np.asarray(ids, dtype=np.int64).tobytes()))
+        signatures = {
+            (year, month): "|".join([str(ranges_table.mtime), stations, db.get_month_signature(year, month, ids)])
+            for year, month in months
+        }
+    cache = poperation.get_operation_cache(os.path.join(PATH, "Datos", "Operacion"))
+    closed = {x: x < (date2.year, date2.month) for x in months}
+    partials = {x: cache.lookup(*x, signatures[x], closed[x]) for x in months}
+    missing = [x for x in months if partials[x] is None]
+    pressures = [(year, month, operational_hourly_pressure(year, month)) for year, month in missing]
+    if WORKERS > 1 and len(missing) > 0:
+        # un mes: bloques de estaciones por proceso
+        block = None if len(missing) > 1 else -(-len(ids) // WORKERS)
+        computed = poperation.parallel_partials(pressures, ranges_table, WORKERS, block)
+    else:
+        computed = [poperation.operation_partial(year, month, press, ranges_table)
+                    for year, month, press in pressures]
+    for partial in computed:
+        key = (partial.year, partial.month)
+        partials[key] = cache.store(partial, signatures[key], closed[key])
+    return [partials[x] for x in months]
 
 
 @st.cache_data
@@ -64,79 +75,109 @@ def download_data(data):
     return data.to_csv().encode('utf-8')
 
 
+def show_report(operation_dict, operation_stats_dict, operation_daily, period, name, nstations, monthly=True):
+    st.markdown(f"**Operación de la red {period}**",
+                help="""Para verificar la operación de las estaciones se utilizaron los rangos **Variables** corresponden
+                a los rangos normales de operación según el día y el horario, con base en el análisis de la información de 2021.""")
+    st.markdown("Número de estaciones que presentaron subpresión o sobrepresión en algún momento de su funcionamiento en el periodo.")
+    cols = st.columns(len(operation_stats_dict))
+    for i, key in enumerate(operation_stats_dict.keys()):
+        cols[i].metric(key, operation_stats_dict[key])
+    
+    xlabel = "Día del mes" if monthly else "Fecha"
+    operation_titles = list(operation_dict.keys())
+    tabs = st.tabs(operation_titles)
+    for i, tab in enumerate(tabs):
+        with tab:
+            st.header(operation_titles[i])
+
+            fig = px.imshow(
+                operation_dict[operation_titles[i]],
+                labels=dict(x=xlabel, y="Hora del día", color="No. Estacion"),
+                color_continuous_scale="viridis",
+                text_auto=monthly,
+                aspect="auto",
+                zmin=0,
+                zmax=int(nstations/2)
+            )
+            st.markdown("No. de estaciones que presentan problemas en su operación para cada hora y día del periodo")
+            st.plotly_chart(fig, use_container_width=True, theme=None)
+            
+            output1 = download_data(operation_dict[operation_titles[i]])
+            st.download_button(
+                label="Descargar datos",
+                data=output1,
+                file_name=f"Operacion por hora_{operation_titles[i]}_{name}.csv",
+                mime="text/csv",
+            )
+
+            fig1 = px.imshow(
+                operation_daily[operation_titles[i]],
+                labels=dict(x="Estación", y=xlabel, color="No. horas"),
+                color_continuous_scale="viridis",
+                text_auto=monthly,
+                aspect="auto",
+                zmin=0,
+                zmax=24
+            )
+            st.markdown("No. de horas con problemas en la operación por día por estación")
+            st.plotly_chart(fig1, use_container_width=True, theme=None)
+
+            output2 = download_data(operation_daily[operation_titles[i]])
+            st.download_button(
+                label="Descargar datos",
+                data=output2,
+                file_name=f"Operacion por dia_{operation_titles[i]}_{name}.csv",
+                mime="text/csv",
+            )
+
+
 #%% Operacion de estaciones
 
 st.title("Reporte de operación de estaciones")
 st.sidebar.title("Sistema de Presiones CDMX")
-year = st.sidebar.selectbox("Seleccionar año", list(range(date2.year, date1.year-1, -1)), 0)
-month = st.sidebar.selectbox("Seleccionar mes", list(range(1, 13)), date2.month-1)
-
-if (pd.to_datetime(f"{year}-{month:02d}-01") > pd.to_datetime(f"{date2.year}-{date2.month:02d}-01") or 
-    pd.to_datetime(f"{year}-{month:02d}-01") < pd.to_datetime(f"{date1.year}-{date1.month:02d}-01")):
-    st.error(f"No se encontraron registros para el mes seleccionado")
+period_type = st.sidebar.radio("Periodo del reporte", ["Mes", "Trimestre", "Año", "Personalizado"], key="operation-period")
+available = poperation.period_months(date1, date2)
+
+if period_type == "Personalizado":
+    labels = [f"{y}-{m:02d}" for y, m in available]
+    start = st.sidebar.selectbox("Mes inicial", labels, max(len(labels)-12, 0), key="operation-start")
+    end = st.sidebar.selectbox("Mes final", labels, len(labels)-1, key="operation-end")
+    months = available[labels.index(start):labels.index(end)+1]
+    period = f"de {start} a {end}"
+    name = f"{start}_{end}"
+else:
+    year = st.sidebar.selectbox("Seleccionar año", list(range(date2.year, date1.year-1, -1)), 0)
+    if period_type == "Mes":
+        month = st.sidebar.selectbox("Seleccionar mes", list(range(1, 13)), date2.month-1)
+        months = [(year, month)]
+        period = f"el mes {year}-{month:02d}"
+        name = f"{year}-{month}"
+    elif period_type == "Trimestre":
+        quarter = st.sidebar.selectbox("Seleccionar trimestre", [1, 2, 3, 4], (date2.month-1)//3, key="operation-quarter")
+        months = [(year, m) for m in range(3*quarter-2, 3*quarter+1)]
+        period = f"el trimestre {year}-T{quarter}"
+        name = f"{year}-T{quarter}"
+    else:
+        months = [(year, m) for m in range(1, 13)]
+        period = f"el año {year}"
+        name = f"{year}"
+    months = [x for x in months if x in available]
+
+if len(months) == 0:
+    st.error(f"No se encontraron registros para el periodo seleccionado")
 else:
     with st.spinner("Generando reporte"):
-        ranges_table = pd.read_csv(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
-
-        press = operational_hourly_pressure(year, month)
-
-        if len(press) == 0:
-            st.error(f"No se encontraron registros para el mes **{year}-{month:02d}**")
-        else:
-            operation_dict, operation_stats_dict, operation_daily = poperation.pressure_ranges_operation(year, month, press, ranges_table)
-
-            st.markdown(f"**Operación de la red el mes {year}-{month:02d}**",
-                        help="""Para verificar la operación de las estaciones se utilizaron los rangos **Variables** corresponden
-                        a los rangos normales de operación según el día y el horario, con base en el análisis de la información de 2021.""")
-            st.markdown("Número de estaciones que presentaron subpresión o sobrepresión en algún momento de su funcionamiento en el mes.")
-            cols = st.columns(len(operation_stats_dict))
-            for i, key in enumerate(operation_stats_dict.keys()):
-                cols[i].metric(key, operation_stats_dict[key])
-            
-            operation_titles = list(operation_dict.keys())
-            tabs = st.tabs(operation_titles)
-            for i, tab in enumerate(tabs):
-                with tab:
-                    st.header(operation_titles[i])
-
-                    fig = px.imshow(
-                        operation_dict[operation_titles[i]],
-                        labels=dict(x="Día del mes", y="Hora del día", color="No. Estacion"),
-                        color_continuous_scale="viridis",
-                        text_auto=True,
-                        aspect="auto",
-                        zmin=0,
-                        zmax=int(press.shape[1]/2)
-                    )
-                    st.markdown("No. de estaciones que presentan problemas en su operación para cada hora y día del mes")
-                    st.plotly_chart(fig, use_container_width=True, theme=None)
-                    
-                    output1 = download_data(operation_dict[operation_titles[i]])
-                    st.download_button(
-                        label="Descargar datos",
-                        data=output1,
-                        file_name=f"Operacion por hora_{operation_titles[i]}_{year}-{month}.csv",
-                        mime="text/csv",
-                    )
-
-                    fig1 = px.imshow(
-                        operation_daily[operation_titles[i]],
-                        labels=dict(x="Estación", y="Día del mes", color="No. horas"),
-                        color_continuous_scale="viridis",
-                        text_auto=True,
-                        aspect="auto",
-                        zmin=0,
-                        zmax=24
-                    )
-                    st.markdown("No. de horas con problemas en la operación por día por estación")
-                    st.plotly_chart(fig1, use_container_width=True, theme=None)
-
-                    output2 = download_data(operation_daily[operation_titles[i]])
-                    st.download_button(
-                        label="Descargar datos",
-                        data=output2,
-                        file_name=f"Operacion por dia_{operation_titles[i]}_{year}-{month}.csv",
-                        mime="text/csv",
-                    )
-
-
+        ranges_table = poperation.get_ranges(os.path.join(PATH, "DatosIniciales", "RangosPresiones_variables.csv"))
+        partials = operation_partials(months, ranges_table)
+        partials = [x for x in partials if len(x.ids) > 0]
+
+    if len(partials) == 0:
+        st.error(f"No se encontraron registros para {period}")
+    elif period_type == "Mes":
+        operation_dict, operation_stats_dict, operation_daily = partials[0].report()
+        show_report(operation_dict, operation_stats_dict, operation_daily, period, name, len(partials[0].ids))
+    else:
+        operation_dict, operation_stats_dict, operation_daily = poperation.combine_partials(partials)
+        show_report(operation_dict, operation_stats_dict, operation_daily, period, name,
+                    max(len(x.ids) for x in partials), monthly=False)
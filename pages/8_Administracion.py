@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Desempeño de consultas (administrador)
+
+@author: zaula
+"""
+
+#%% Libraries
+import os
+import toml
+import pandas as pd
+import streamlit as st
+
+import data_bases as dbs
+
+
+#%% Datos iniciales
+PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+config = toml.load(os.path.join(PATH, "config.toml"))
+
+
+#%% App
+
+st.title("Desempeño de Consultas")
+st.sidebar.title("Sistema de Presiones CDMX")
+
+if not st.session_state.get("admin", False):
+    clave = st.text_input("Clave de administrador", type="password", key="admin-clave")
+    if clave != config["admin"]["Clave"]:
+        if clave:
+            st.error("Clave incorrecta.")
+        st.stop()
+    st.session_state["admin"] = True
+
+st.sidebar.subheader("Opciones")
+dbs.query_stats.threshold = st.sidebar.number_input(
+    "Umbral de consulta lenta (s)",
+    min_value=0.0,
+    value=float(dbs.query_stats.threshold),
+    step=0.1,
+    key="admin-threshold"
+)
+dbs.query_stats.explain = st.sidebar.checkbox(
+    "Guardar plan de consulta (EXPLAIN QUERY PLAN)",
+    value=dbs.query_stats.explain,
+    key="admin-explain"
+)
+if st.sidebar.button("Reiniciar estadísticas", key="admin-clear"):
+    dbs.query_stats.clear()
+
+st.markdown(
+    f"**Duración por método** (últimas {dbs.query_stats.size} llamadas; "
+    "Cache: llamadas resueltas con la cache de consultas)"
+)
+st.dataframe(dbs.query_stats.statistics().round(2), use_container_width=True)
+
+st.markdown("**Histograma de duración** (llamadas por intervalo, sin cache)")
+st.dataframe(dbs.query_stats.histogram(), use_container_width=True)
+
+st.markdown(f"**Consultas lentas** (duración mayor a {dbs.query_stats.threshold:g} s)")
+slow = dbs.query_stats.slow_queries()
+if len(slow) == 0:
+    st.info("No se han registrado consultas lentas.")
+else:
+    st.dataframe(slow.drop(columns="Plan").iloc[::-1], use_container_width=True)
+    with st.expander("Planes de consulta"):
+        for _, row in slow.iloc[::-1].iterrows():
+            if row["Plan"]:
+                st.markdown(f"{row['Fecha']} **{row['Metodo']}** ({row['Duracion (ms)']:.1f} ms)")
+                st.code(row["Plan"], language="sql")
+
+col1, col2 = st.columns(2)
+with col1:
+    st.markdown("**Cache de consultas**")
+    st.dataframe(pd.Series(dbs.query_cache.statistics(), name="Valor"), use_container_width=True)
+with col2:
+    st.markdown("**Conexiones**")
+    st.dataframe(dbs.pool_statistics(), use_container_width=True)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Cubo de presiones horarias estacion x hora mapeado a disco
+
+@author: zaula
+"""
+
+#%% Importar librerias
+import os
+import json
+import threading
+import numpy as np
+
+
+#%% Clases
+
+class PressureCube:
+    """
+    Presiones horarias en un arreglo float32 [estacion, hora] mapeado a disco
+    (numpy.memmap). Las horas sin registro se guardan como NaN.
+    La hora 0 del cubo corresponde a la hora epoch "inicio".
+    Las estaciones, el periodo y el arreglo se reemplazan juntos bajo lock
+    (reentrante); las consultas toman el mismo lock.
+    """
+
+    def __init__(self, folder, name="Cubo"):
+        self.fdata = os.path.join(folder, f"{name}.dat")
+        self.fmeta = os.path.join(folder, f"{name}.json")
+        self.mtime = None
+        self.data = None
+        self.ids = np.array([], dtype=np.int64)
+        self.start = 0
+        self.hours = 0
+        self.version = None
+        self.lock = threading.RLock()
+        self.load()
+
+    def exists(self):
+        return os.path.exists(self.fdata) and os.path.exists(self.fmeta)
+
+    def load(self):
+        with self.lock:
+            if not self.exists():
+                return False
+            mtime = os.path.getmtime(self.fmeta)
+            if mtime == self.mtime:
+                return True
+            with open(self.fmeta, encoding="utf-8") as fid:
+                meta = json.load(fid)
+            ids = np.array(meta["ids"], dtype=np.int64)
+            hours = int(meta["horas"])
+            if len(ids) == 0 or hours == 0:
+                data = np.zeros((len(ids), hours), dtype=np.float32)
+            else:
+                data = np.memmap(self.fdata, dtype=np.float32, mode="r", shape=(len(ids), hours))
+            self.ids, self.data = ids, data
+            self.start = int(meta["inicio"])
+            self.hours = hours
+            self.version = meta["version"]
+            self.mtime = mtime
+            return True
+
+    def _save_meta(self, ids=None, start=None, hours=None):
+        meta = {
+            "ids": [int(x) for x in (self.ids if ids is None else ids)],
+            "inicio": int(self.start if start is None else start),
+            "horas": int(self.hours if hours is None else hours),
+            "version": self.version,
+        }
+        with open(self.fmeta + ".tmp", "w", encoding="utf-8") as fid:
+            json.dump(meta, fid)
+        os.replace(self.fmeta + ".tmp", self.fmeta)
+
+    def build(self, blocks, ids, period, version):
+        """
+        Construye el cubo completo. blocks: bloques (ids, tiempos, valores)
+        de todos los registros, ids: estaciones con registros y period:
+        (tiempo1, tiempo2) del primer y ultimo registro.
+        El cubo anterior sigue disponible hasta que termina la construccion.
+        """
+        tmin, tmax = period
+        ids = np.array(ids, dtype=np.int64)
+        if tmin is None:
+            start, hours = 0, 0
+        else:
+            # capacidad hasta el final del año siguiente al ultimo registro
+            start = int(tmin // 3600)
+            last_year = np.datetime64(int(tmax), "s").astype("datetime64[Y]")
+            end = (last_year + 2).astype("datetime64[h]").astype(np.int64)
+            hours = int(end) - start
+        # se construye en un archivo temporal y se reemplaza el anterior, las
+        # sesiones que lo tienen mapeado conservan la version previa
+        ftemp = self.fdata + ".tmp"
+        if len(ids) == 0 or hours == 0:
+            open(ftemp, "wb").close()
+        else:
+            data = np.memmap(ftemp, dtype=np.float32, mode="w+", shape=(len(ids), hours))
+            data[:] = np.nan
+            for block_ids, times, values in blocks:
+                data[np.searchsorted(ids, block_ids), times // 3600 - start] = values
+            data.flush()
+            del data
+        with self.lock:
+            os.replace(ftemp, self.fdata)
+            self.version = version
+            self._save_meta(ids, start, hours)
+            self.mtime = None
+            self.load()
+
+    def write(self, ids, times, values, version):
+        """
+        Escribe presiones en el cubo. Regresa False si alguna estacion u hora
+        queda fuera del cubo y es necesario reconstruirlo.
+        """
+        with self.lock:
+            if not self.exists():
+                return False
+            ids = np.asarray(ids, dtype=np.int64)
+            hours = np.asarray(times, dtype=np.int64) // 3600 - self.start
+            slots = self.slots(ids)
+            if (slots < 0).any() or (hours < 0).any() or (hours >= self.hours).any():
+                return False
+            if len(ids) == 0:
+                return True
+            data = np.memmap(self.fdata, dtype=np.float32, mode="r+",
+                             shape=(len(self.ids), self.hours))
+            data[slots, hours] = np.asarray(values, dtype=np.float32)
+            data.flush()
+            del data
+            self.version = version
+            self._save_meta()
+            return True
+
+    def invalidate(self):
+        """
+        Marca el cubo como desactualizado, se reconstruye en la siguiente
+        consulta
+        """
+        with self.lock:
+            self.version = None
+            self._save_meta()
+
+    def slots(self, ids):
+        """
+        Posicion de cada estacion en el cubo, -1 si no existe
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        slots = np.searchsorted(self.ids, ids)
+        slots[slots >= len(self.ids)] = 0
+        slots[self.ids[slots] != ids] = -1
+        return slots
+
+    def gather(self, time, ids=None):
+        """
+        Presiones de varias estaciones en una hora (time en segundos epoch).
+        Regresa (ids, valores) sin estaciones faltantes.
+        """
+        with self.lock:
+            hour = int(time // 3600) - self.start
+            if ids is None:
+                ids = self.ids
+                slots = np.arange(len(ids))
+            else:
+                ids = np.asarray(ids, dtype=np.int64)
+                slots = self.slots(ids)
+                ids, slots = ids[slots >= 0], slots[slots >= 0]
+            if hour < 0 or hour >= self.hours:
+                return ids[:0], np.array([], dtype=np.float32)
+            values = self.data[slots, hour]
+        mask = ~np.isnan(values)
+        return ids[mask], values[mask]
+
+    def window(self, time, hours=24, ids=None):
+        """
+        Presiones [hora, estacion] desde time (segundos epoch). Sin seleccion
+        de estaciones es una vista del cubo (sin copia).
+        """
+        with self.lock:
+            hour = int(time // 3600) - self.start
+            h1, h2 = max(hour, 0), min(hour + hours, self.hours)
+            if ids is None:
+                ids = self.ids
+                block = self.data[:, h1:h2] if h2 > h1 else self.data[:, :0]
+            else:
+                ids = np.asarray(ids, dtype=np.int64)
+                slots = self.slots(ids)
+                ids, slots = ids[slots >= 0], slots[slots >= 0]
+                block = self.data[slots, h1:h2] if h2 > h1 else self.data[slots, :0]
+        return np.arange(h1, max(h1, h2)) - hour, ids, block.T
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def get_cube(folder, name="Cubo"):
+    """
+    Cubo compartido por proceso, se recarga si cambian sus metadatos
+    """
+    key = os.path.join(os.path.abspath(folder), name)
+    with _cubes_lock:
+        if key not in _cubes:
+            _cubes[key] = PressureCube(folder, name)
+        cube = _cubes[key]
+        cube.load()
+        return cube
@@ -9,12 +9,170 @@ Obtener rangos de presiones
 import os
 import numpy as np
 import pandas as pd
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from calendar import monthrange
-from scipy.interpolate import interp1d
 import warnings
 warnings.filterwarnings('ignore')
 
 
+path = os.path.abspath(os.path.dirname(__file__))
+
+# Limites de los rangos variables (semaforos verde, amarillo, rojo y violeta)
+BANDS = ["Min1", "Max1", "Min2", "Max2", "Min3", "Max3", "Min4", "Max4"]
+
+
+#%% Rangos compilados
+
+class RangesCube:
+    """
+    Rangos variables compilados en un arreglo [estacion, mes, hora, banda]
+    a partir de los renglones (Mes inicio, Mes final, Hora inicio, Hora final)
+    de RangosPresiones_variables.csv. Los meses son [inicio, final) salvo
+    el mes final 12, que se incluye; las horas son [inicio, final). Las horas
+    sin rango toman el rango de la hora previa (como la interpolacion
+    "previous") y los traslapes conservan el primer renglon; ambos casos se
+    reportan en issues.
+    Los limites se guardan en float64: los rangos usan diferencias de 1e-8
+    (5.3 / 5.30000001) que float32 no distingue.
+    Las estaciones y los limites se reemplazan juntos bajo lock (reentrante)
+    y las consultas toman el mismo lock.
+    """
+
+    def __init__(self, table=None, fname=None):
+        self.fname = fname
+        self.mtime = None
+        self.ids = np.array([], dtype=np.int64)
+        self.data = np.zeros((0, 12, 24, len(BANDS)))
+        self.issues = pd.DataFrame(columns=["Estacion", "Mes", "Hora", "Tipo"])
+        self.lock = threading.RLock()
+        if table is not None:
+            self.compile(table)
+        elif fname is not None:
+            self.load()
+
+    def load(self):
+        """
+        Compila el archivo si cambio su fecha de modificacion
+        """
+        mtime = os.path.getmtime(self.fname)
+        if mtime != self.mtime:
+            self.compile(pd.read_csv(self.fname))
+            self.mtime = mtime
+        return self
+
+    def compile(self, table):
+        stations = table["Estacion"].to_numpy(dtype=np.int64)
+        ids = np.unique(stations)
+        data = np.full((len(ids), 12, 24, len(BANDS)), np.nan)
+        count = np.zeros((len(ids), 12, 24), dtype=np.int64)
+        slots = np.searchsorted(ids, stations)
+        months, hours = np.arange(1, 13), np.arange(24)
+        columns = [table[key].to_numpy(dtype=np.int64) for key in
+                   ("Mes inicio", "Mes final", "Hora inicio", "Hora final")]
+        values = table[BANDS].to_numpy(dtype=np.float64)
+        # en orden inverso para que el primer renglon prevalezca
+        for row in range(len(table) - 1, -1, -1):
+            m1, m2, h1, h2 = (column[row] for column in columns)
+            mmask = (months >= m1) & ((months < m2) | ((months == m2) & (m2 == 12)))
+            hmask = (hours >= h1) & (hours < h2)
+            cells = np.ix_([slots[row]], mmask, hmask)
+            data[cells] = values[row]
+            count[cells] += 1
+        for hour in range(1, 24):
+            gap = count[:, :, hour] == 0
+            data[:, :, hour][gap] = data[:, :, hour - 1][gap]
+        issues = self._issues(ids, count)
+        with self.lock:
+            self.ids, self.data, self.issues = ids, data, issues
+        return self
+
+    def _issues(self, ids, count):
+        frames = []
+        for kind, mask in (("Faltante", count == 0), ("Traslape", count > 1)):
+            slot, month, hour = np.nonzero(mask)
+            frames.append(pd.DataFrame({"Estacion": ids[slot], "Mes": month + 1,
+                                        "Hora": hour, "Tipo": kind}))
+        return pd.concat(frames, ignore_index=True)
+
+    def validate(self):
+        """
+        Horas faltantes y traslapadas por estacion y mes
+        (Estacion, Mes, Hora, Tipo)
+        """
+        return self.issues.copy()
+
+    def slots(self, ids):
+        """
+        Posicion de cada estacion en el arreglo, -1 si no tiene rangos
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        slots = np.searchsorted(self.ids, ids)
+        slots[slots >= len(self.ids)] = 0
+        slots[self.ids[slots] != ids] = -1
+        return slots
+
+    def lookup(self, ids, months, hours):
+        """
+        Limites [n, banda] para vectores de estaciones, meses (1-12) y horas
+        (0-23); las estaciones sin rangos regresan NaN
+        """
+        ids, months, hours = np.broadcast_arrays(np.asarray(ids, dtype=np.int64),
+                                                 np.asarray(months, dtype=np.int64),
+                                                 np.asarray(hours, dtype=np.int64))
+        with self.lock:
+            slots = self.slots(ids.ravel())
+            valid = slots >= 0
+            values = np.full((len(slots), len(BANDS)), np.nan)
+            values[valid] = self.data[slots[valid], months.ravel()[valid] - 1, hours.ravel()[valid]]
+        return values
+
+    def gather(self, ids, times):
+        """
+        Limites [n, banda] para vectores de estaciones y fechas
+        """
+        times = pd.DatetimeIndex(np.atleast_1d(times))
+        return self.lookup(ids, times.month, times.hour)
+
+    def station(self, ide, month):
+        """
+        Limites [hora, banda] de una estacion en un mes
+        """
+        return self.lookup(np.full(24, ide), month, np.arange(24))
+
+
+def compile_ranges(ranges_table):
+    """
+    Rangos compilados a partir de la tabla de rangos variables
+    """
+    if isinstance(ranges_table, RangesCube):
+        return ranges_table
+    return RangesCube(ranges_table)
+
+
+_ranges = {}
+_ranges_lock = threading.Lock()
+
+
+def get_ranges(fname=None):
+    """
+    Rangos compilados compartidos por proceso, se recompilan si cambia la
+    fecha de modificacion del archivo
+    """
+    if fname is None:
+        fname = os.path.join(path, "DatosIniciales", "RangosPresiones_variables.csv")
+    key = os.path.abspath(fname)
+    with _ranges_lock:
+        if key not in _ranges:
+            _ranges[key] = RangesCube(fname=key)
+        ranges = _ranges[key]
+    with ranges.lock:
+        return ranges.load()
+
+
 #%% Funciones
 
 
@@ -49,41 +207,36 @@ def constant_operation(stations, ranges_table):
     return new_stations, operation, color_sequence
 
 
+# Estados del semaforo de rangos variables, en orden de prioridad
+OPERATION_STATES = ["Buen funcionamiento", "Sobrepresión", "Presión baja", "Fuera de funcionamiento"]
+
+
 def stations_operation(stations, date, hour, ranges_table):
+    """
+    Semaforo de cada estacion con los rangos variables del mes y hora.
+    Las estaciones sin rango o con presion fuera de todos los rangos quedan
+    con Semaforo "" (columna categorica).
+    """
 
     new_stations = stations.copy()
     new_stations.set_index("ID", inplace=True, drop=False)
-    new_stations["Semaforo"] = ""
 
-    month = date.month
-    mask = ((month >= ranges_table["Mes inicio"]) & (month < ranges_table["Mes final"])
-            & (hour >= ranges_table["Hora inicio"]) & (hour < ranges_table["Hora final"]))
-    data_ranges = ranges_table.loc[
-        mask,
-        ["Estacion", "Min1", "Max1", "Min2", "Max2", "Min3", "Max3", "Min4", "Max4"]
+    ranges = compile_ranges(ranges_table)
+    values = ranges.lookup(new_stations["ID"].to_numpy(), date.month, hour)
+    ranges = dict(zip(BANDS, values.T))
+
+    pressure = new_stations["Presion (km/cm2)"].to_numpy(dtype=float)
+    conditions = [
+        (pressure >= ranges["Min1"]) & (pressure < ranges["Max1"]),
+        (pressure >= ranges["Min2"]) & (pressure < ranges["Max2"]),
+        (pressure > ranges["Min3"]) & (pressure < ranges["Max3"]),
+        (pressure >= ranges["Min4"]) & (pressure <= ranges["Max4"]),
     ]
-    data_ranges.set_index("Estacion", inplace=True)
-
-    for i in range(len(stations)):
-        station = stations.iloc[i, :]
-        idx = station["ID"]
-        pressure = station["Presion (km/cm2)"]
-        ranges = data_ranges.loc[idx, :]
-        if pressure >= ranges["Min1"] and pressure < ranges["Max1"]:
-            new_stations.loc[idx, "Semaforo"] = "Buen funcionamiento"
-        elif pressure >= ranges["Min2"] and pressure < ranges["Max2"]:
-            new_stations.loc[idx, "Semaforo"] = "Sobrepresión"
-        elif pressure > ranges["Min3"] and pressure < ranges["Max3"]:
-            new_stations.loc[idx, "Semaforo"] = "Presión baja"
-        elif pressure >= ranges["Min4"] and pressure <= ranges["Max4"]:
-            new_stations.loc[idx, "Semaforo"] = "Fuera de funcionamiento"
-        
-    operation = {
-        "Buen funcionamiento": (new_stations["Semaforo"] == "Buen funcionamiento").sum(),
-        "Sobrepresión": (new_stations["Semaforo"] == "Sobrepresión").sum(),
-        "Presión baja": (new_stations["Semaforo"] == "Presión baja").sum(),
-        "Fuera de funcionamiento": (new_stations["Semaforo"] == "Fuera de funcionamiento").sum(),
-    }
+    codes = np.select(conditions, np.arange(1, len(OPERATION_STATES) + 1), default=0)
+    new_stations["Semaforo"] = pd.Categorical.from_codes(codes, [""] + OPERATION_STATES)
+
+    counts = np.bincount(codes, minlength=len(OPERATION_STATES) + 1)
+    operation = {key: counts[i + 1] for i, key in enumerate(OPERATION_STATES)}
     
     color_sequence = {
         "Buen funcionamiento": "#009d5f",
@@ -97,119 +250,359 @@ def stations_operation(stations, date, hour, ranges_table):
 
 def pressure_hourly(ide, date, ranges_table):
 
-    month = date.month
-    mask = ((month >= ranges_table["Mes inicio"]) & (month <= ranges_table["Mes final"])
-            & (ide == ranges_table["Estacion"]))
-    ranges = ranges_table.loc[mask, :]
-
+    ranges = compile_ranges(ranges_table)
     hours = np.arange(0, 23+0.2, 0.2)
+    values = ranges.station(ide, date.month)
     data = pd.DataFrame(
-        np.full((len(hours), 8), np.nan),
+        values[np.floor(hours + 1e-6).astype(int)],
         index=hours,
-        columns=["Min1", "Max1", "Min2", "Max2", "Min3", "Max3", "Min4", "Max4"]
+        columns=BANDS
     )
     
-    x = ranges.iloc[:, 3].values
-    for col in data.columns:
-        interp = interp1d(x, ranges.loc[:, col].values, kind="previous", fill_value="extrapolate")
-        data.loc[:, col].values[:] = interp(hours)
-    
     return data
 
 
 def pressure_ranges_timeserie(ide, year, month, ranges_table):
     
+    ranges = compile_ranges(ranges_table)
     days = monthrange(year, month)[1]
     start = f"{year}-{month:02d}-01 00:00"
     end = f"{year}-{month:02d}-{days:02d} 23:00"
     dates = pd.date_range(start, end, freq="1H")
     data = pd.DataFrame(
-        np.full((len(dates), 8), np.nan),
+        ranges.station(ide, month)[dates.hour],
         index=dates,
-        columns=["Min1", "Max1", "Min2", "Max2", "Min3", "Max3", "Min4", "Max4"],
+        columns=BANDS,
         dtype=np.float32
     )
-
-    mask = ((month >= ranges_table["Mes inicio"]) & (month <= ranges_table["Mes final"])
-        & (ide == ranges_table["Estacion"]))
-    ranges = ranges_table.loc[mask, :]
-    x = ranges.iloc[:, 3].values
-    for col in data.columns:
-        interp = interp1d(x, ranges.loc[:, col].values, kind="previous", fill_value="extrapolate")
-        for hour in np.arange(0, 24):
-            data.loc[dates.hour == hour, col] = np.float32((interp(hour)))
     
     return data
 
 
-def pressure_ranges_operation(year, month, pressure, ranges_table):
+# Problemas de operacion del reporte mensual
+OPERATION_PROBLEMS = ["Sobrepresión", "Presión baja", "Fuera de funcionamiento"]
+
+
+def band_matrix(ranges_table, ids, dates):
+    """
+    Limites [hora, estacion, banda] de las estaciones para cada fecha, en
+    float32 como pressure_ranges_timeserie
+    """
+    ranges = compile_ranges(ranges_table)
+    ids = np.asarray(ids, dtype=np.int64)
+    values = ranges.lookup(ids[None, :], np.asarray(dates.month)[:, None], np.asarray(dates.hour)[:, None])
+    return values.reshape(len(dates), len(ids), len(BANDS)).astype(np.float32)
+
+
+def operation_masks(pressure, bands):
+    """
+    Mascaras [hora, estacion] de sobrepresion (presion >= Min2), presion
+    baja (presion < Max3) y sin datos (sin presion o sin rangos)
+    """
+    valid = ~np.isnan(pressure) & ~np.isnan(bands).any(axis=2)
+    with np.errstate(invalid="ignore"):
+        over = valid & (pressure >= bands[:, :, BANDS.index("Min2")])
+        low = valid & (pressure < bands[:, :, BANDS.index("Max3")])
+    return over, low, ~valid
+
+
+def operation_counts(pressure, bands):
+    """
+    Conteos del reporte mensual a partir de la matriz de presiones horarias
+    [hora, estacion] de un mes completo (dias x 24 horas) y sus limites.
+    Regresa para cada problema las estaciones por hora y dia [24, dia],
+    las horas por dia y estacion [dia, estacion] (NaN en dias sin datos para
+    sobrepresion y presion baja) y las estaciones que presentaron el problema
+    en algun momento [estacion].
+    """
+    hours, stations = pressure.shape
+    days = hours // 24
+    masks = dict(zip(OPERATION_PROBLEMS, operation_masks(pressure, bands)))
+    valid_days = (~masks["Fuera de funcionamiento"]).reshape(days, 24, stations).any(axis=1)
+    hourly, daily, flags = {}, {}, {}
+    for key, mask in masks.items():
+        hourly[key] = mask.sum(axis=1).reshape(days, 24).T
+        counts = mask.reshape(days, 24, stations).sum(axis=1)
+        if key != "Fuera de funcionamiento":
+            counts = np.where(valid_days, counts, np.nan)
+        daily[key] = counts
+        flags[key] = mask.any(axis=0)
+    return hourly, daily, flags
+
 
+class OperationPartial:
+    """
+    Resultado parcial del reporte de operacion de un mes: estaciones por
+    hora y dia [problema, 24, dia], horas por dia y estacion
+    [problema, dia, estacion] y estaciones con problemas [problema, estacion].
+    signature identifica los datos y rangos con los que se calculo.
+    """
+
+    def __init__(self, year, month, ids, hourly, daily, flags, signature=""):
+        self.year = int(year)
+        self.month = int(month)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.hourly = hourly
+        self.daily = daily
+        self.flags = flags
+        self.signature = signature
+
+    @property
+    def dates(self):
+        return pd.date_range(f"{self.year}-{self.month:02d}-01", periods=self.hourly.shape[2], freq="D")
+
+    def save(self, fname):
+        with open(fname + ".tmp", "wb") as fid:
+            np.savez(fid, year=self.year, month=self.month, ids=self.ids, hourly=self.hourly,
+                     daily=self.daily, flags=self.flags, signature=np.array(self.signature))
+        os.replace(fname + ".tmp", fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(data["year"], data["month"], data["ids"], data["hourly"], data["daily"],
+                       data["flags"], str(data["signature"]))
+
+    def report(self):
+        """
+        Reporte mensual (operation_dict, operation_stats_dict, operation_daily)
+        """
+        days = self.hourly.shape[2]
+        operation_dict, operation_stats_dict, operation_daily = {}, {}, {}
+        for i, key in enumerate(OPERATION_PROBLEMS):
+            operation_dict[key] = pd.DataFrame(self.hourly[i], index=np.arange(24), columns=np.arange(1, days+1))
+            operation_stats_dict[key] = self.flags[i].sum()
+            operation_daily[key] = pd.DataFrame(self.daily[i], index=np.arange(1, days+1), columns=self.ids)
+        operation_daily["Fuera de funcionamiento"] = operation_daily["Fuera de funcionamiento"].astype(np.int64)
+        return operation_dict, operation_stats_dict, operation_daily
+
+
+def month_dates(year, month):
     days = monthrange(year, month)[1]
     start = f"{year}-{month:02d}-01 00:00"
     end = f"{year}-{month:02d}-{days:02d} 23:00"
-    dates = pd.date_range(start, end, freq="1H")
-    operation = pd.DataFrame(
-        np.zeros((len(dates), 3), dtype=int),
-        columns=["Sobrepresión", "Presión baja", "Fuera de funcionamiento"],
-        index=dates
+    return pd.date_range(start, end, freq="1H")
+
+
+def _partial_arrays(values, ids, dates, ranges_table):
+    # (hourly, daily, flags) apilados por problema para un bloque de estaciones
+    bands = band_matrix(ranges_table, ids, dates)
+    hourly, daily, flags = operation_counts(values, bands)
+    return (
+        np.stack([hourly[key] for key in OPERATION_PROBLEMS]),
+        np.stack([daily[key] for key in OPERATION_PROBLEMS]).astype(float),
+        np.stack([flags[key] for key in OPERATION_PROBLEMS]),
     )
-    operation_stats_dict = {
-        "Sobrepresión": 0,
-        "Presión baja": 0,
-        "Fuera de funcionamiento": 0,
-    }
-    operation_daily = {
-        "Sobrepresión": pd.DataFrame(np.zeros((days, pressure.shape[1]), dtype=int), columns=pressure.columns, index=np.arange(1, days+1)),
-        "Presión baja": pd.DataFrame(np.zeros((days, pressure.shape[1]), dtype=int), columns=pressure.columns, index=np.arange(1, days+1)),
-        "Fuera de funcionamiento": pd.DataFrame(np.zeros((days, pressure.shape[1]), dtype=int), columns=pressure.columns, index=np.arange(1, days+1)),
-    }
 
-    for ide in pressure.columns:
-        station_ranges = pressure_ranges_timeserie(ide, year, month, ranges_table)
-        station_ranges["Presion"] = pressure.loc[:, ide]
-        station_ranges = station_ranges.dropna(how="any")
-        d1 = (station_ranges["Presion"] >= station_ranges["Min2"]).fillna(0).astype(int)
-        d2 = (station_ranges["Presion"] < station_ranges["Max3"]).fillna(0).astype(int)
-        d3 = pd.Series(np.ones(len(dates), dtype=int), index=dates)
-        d3.loc[station_ranges.index] = 0
-        
-        operation_stats_dict["Sobrepresión"] += min(1, d1.sum())
-        operation_stats_dict["Presión baja"] += min(1, d2.sum())
-        operation_stats_dict["Fuera de funcionamiento"] += min(1, d3.sum())
-        
-        operation.loc[station_ranges.index, "Sobrepresión"] += d1
-        operation.loc[station_ranges.index, "Presión baja"] += d2
-        operation.loc[dates, "Fuera de funcionamiento"] += d3.loc[dates]
-
-        operation_daily["Sobrepresión"].loc[:, ide] = d1.groupby(d1.index.day).sum()
-        operation_daily["Presión baja"].loc[:, ide] = d2.groupby(d2.index.day).sum()
-        operation_daily["Fuera de funcionamiento"].loc[:, ide] = d3.groupby(d3.index.day).sum()
-    
-    operation_dict = {
-        "Sobrepresión": pd.pivot_table(
-            operation,
-            values="Sobrepresión",
-            index=operation.index.hour,
-            columns=operation.index.day,
-            aggfunc="sum"
-            ),
-        "Presión baja": pd.pivot_table(
-            operation,
-            values="Presión baja",
-            index=operation.index.hour,
-            columns=operation.index.day,
-            aggfunc="sum"
-            ),
-        "Fuera de funcionamiento": pd.pivot_table(
-            operation,
-            values="Fuera de funcionamiento",
-            index=operation.index.hour,
-            columns=operation.index.day,
-            aggfunc="sum"
-            ),
-    }
 
+def operation_partial(year, month, pressure, ranges_table):
+    """
+    Resultado parcial del reporte de operacion de un mes a partir de la
+    matriz de presiones horarias [fecha, estacion].
+    Los limites siguen los meses [inicio, final) de RangesCube: en un mes
+    frontera (3 en los renglones 1-3 y 3-9) solo aplica el renglon que inicia
+    en ese mes. La version con interp1d mezclaba los renglones de ambas
+    temporadas, por lo que en esos meses el reporte puede diferir del anterior.
+    """
+    dates = month_dates(year, month)
+    pressure = pressure.reindex(dates)  # matriz horaria completa del mes
+    ids = pressure.columns.to_numpy(dtype=np.int64)
+    arrays = _partial_arrays(pressure.to_numpy(dtype=float), ids, dates, ranges_table)
+    return OperationPartial(year, month, ids, *arrays)
+
+
+def pressure_ranges_operation(year, month, pressure, ranges_table):
+    return operation_partial(year, month, pressure, ranges_table).report()
+
+
+#%% Ejecucion en paralelo
+
+_worker_ranges = None
+
+
+def _init_worker(ids, data):
+    # Rangos compilados de cada proceso (sin leer el archivo)
+    global _worker_ranges
+    _worker_ranges = RangesCube()
+    _worker_ranges.ids = ids
+    _worker_ranges.data = data
+
+
+def _operation_block(name, shape, year, month, ids, columns):
+    # Bloque de estaciones [columns[0], columns[1]) de la matriz compartida
+    shm = SharedMemory(name=name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[:, columns[0]:columns[1]]
+    try:
+        return _partial_arrays(values, ids, month_dates(year, month), _worker_ranges)
+    finally:
+        del values
+        shm.close()
+
+
+def _shared_array(values):
+    shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+    return shm
+
+
+def parallel_partials(pressures, ranges_table, workers=None, block=None):
+    """
+    Parciales mensuales calculados en un ProcessPoolExecutor con workers
+    procesos. pressures: lista de (año, mes, matriz de presiones horarias
+    [fecha, estacion]). Cada matriz se pasa a los procesos en memoria
+    compartida; con block se divide ademas en bloques de block estaciones.
+    Los bloques se combinan en orden, el resultado es igual al de
+    operation_partial.
+    """
+    ranges = compile_ranges(ranges_table)
+    with ranges.lock:
+        initargs = (ranges.ids, ranges.data)
+    shared, tasks = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            for year, month, pressure in pressures:
+                pressure = pressure.reindex(month_dates(year, month))
+                ids = pressure.columns.to_numpy(dtype=np.int64)
+                values = pressure.to_numpy(dtype=np.float64)
+                shm = _shared_array(values)
+                shared.append(shm)
+                step = max(int(block or len(ids)), 1)
+                futures = [
+                    pool.submit(_operation_block, shm.name, values.shape, year, month,
+                                ids[i:i+step], (i, i+step))
+                    for i in range(0, max(len(ids), 1), step)
+                ]
+                tasks.append((year, month, ids, futures))
+            partials = []
+            for year, month, ids, futures in tasks:
+                blocks = [future.result() for future in futures]
+                partials.append(OperationPartial(
+                    year,
+                    month,
+                    ids,
+                    np.sum([x[0] for x in blocks], axis=0),
+                    np.concatenate([x[1] for x in blocks], axis=2),
+                    np.concatenate([x[2] for x in blocks], axis=1),
+                ))
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+    return partials
+
+
+def combine_partials(partials):
+    """
+    Reporte de operacion de un periodo a partir de los parciales mensuales:
+    estaciones por hora y fecha, horas por fecha y estacion (NaN si la
+    estacion no se incluyo en el mes) y numero de estaciones que presentaron
+    cada problema en algun momento del periodo.
+    """
+    partials = sorted(partials, key=lambda x: (x.year, x.month))
+    ids = np.unique(np.concatenate([x.ids for x in partials])) if partials else np.array([], dtype=np.int64)
+    dates = pd.DatetimeIndex(np.concatenate([x.dates.values for x in partials])) if partials else pd.DatetimeIndex([])
+    hourly = np.concatenate([x.hourly for x in partials], axis=2) if partials else np.zeros((len(OPERATION_PROBLEMS), 24, 0), dtype=int)
+    daily = np.full((len(OPERATION_PROBLEMS), len(dates), len(ids)), np.nan)
+    flags = np.zeros((len(OPERATION_PROBLEMS), len(ids)), dtype=bool)
+    day = 0
+    for partial in partials:
+        columns = np.searchsorted(ids, partial.ids)
+        days = partial.daily.shape[1]
+        daily[:, day:day+days, columns] = partial.daily
+        flags[:, columns] |= partial.flags
+        day += days
+
+    operation_dict, operation_stats_dict, operation_daily = {}, {}, {}
+    for i, key in enumerate(OPERATION_PROBLEMS):
+        operation_dict[key] = pd.DataFrame(hourly[i], index=np.arange(24), columns=dates)
+        operation_stats_dict[key] = flags[i].sum()
+        operation_daily[key] = pd.DataFrame(daily[i], index=dates, columns=ids)
     return operation_dict, operation_stats_dict, operation_daily
 
 
+def period_months(start, end):
+    """
+    Lista (año, mes) de los meses entre dos fechas (inclusive)
+    """
+    months = pd.period_range(pd.Timestamp(start).to_period("M"), pd.Timestamp(end).to_period("M"), freq="M")
+    return [(x.year, x.month) for x in months]
+
+
+#%% Cache de parciales mensuales
+
+class OperationCache:
+    """
+    Parciales mensuales del reporte de operacion en memoria. Los parciales
+    de meses cerrados se guardan en folder (Operacion_AAAA_MM.npz); un
+    parcial se recalcula solo si cambia su firma (datos del mes, estaciones
+    o rangos).
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    def fname(self, year, month):
+        return os.path.join(self.folder, f"Operacion_{year}_{month:02d}.npz")
+
+    def lookup(self, year, month, signature, persist=False):
+        """
+        Parcial del mes con la firma indicada desde memoria o disco, None si
+        se debe calcular
+        """
+        key = (int(year), int(month))
+        with self.lock:
+            partial = self.memory.get(key)
+        if partial is not None and partial.signature == signature:
+            return partial
+        fname = self.fname(year, month)
+        if persist and os.path.exists(fname):
+            partial = OperationPartial.load(fname)
+            if partial.signature == signature:
+                with self.lock:
+                    self.memory[key] = partial
+                return partial
+        return None
+
+    def store(self, partial, signature, persist=False):
+        partial.signature = signature
+        with self.lock:
+            self.memory[(partial.year, partial.month)] = partial
+        if persist:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            partial.save(self.fname(partial.year, partial.month))
+        return partial
+
+    def get(self, year, month, signature, compute, persist=False):
+        """
+        Parcial del mes. compute() calcula el parcial si no existe con la
+        firma indicada; persist=True lo guarda en disco (meses cerrados).
+        """
+        partial = self.lookup(year, month, signature, persist)
+        if partial is None:
+            partial = self.store(compute(), signature, persist)
+        return partial
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+
+
+_operation_caches = {}
+_operation_caches_lock = threading.Lock()
+
 
+def get_operation_cache(folder=None):
+    """
+    Cache de parciales compartido por proceso para cada carpeta
+    """
+    if folder is None:
+        folder = os.path.join(path, "Datos", "Operacion")
+    key = os.path.abspath(folder)
+    with _operation_caches_lock:
+        if key not in _operation_caches:
+            _operation_caches[key] = OperationCache(key)
+        return _operation_caches[key]
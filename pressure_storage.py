@@ -0,0 +1,807 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento de los registros de presiones horarias
+
+@author: zaula
+"""
+
+#%% Importar librerias
+import os
+import re
+import itertools
+import stat
+import zlib
+import sqlite3
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from urllib.request import pathname2url
+
+
+# Columnas de los registros (sin el texto de Fecha, que se deriva de Tiempo)
+COLUMNS = ("ID", "Tiempo", "Ano", "Mes", "Dia", "Hora", "Valor")
+INTEGER_COLUMNS = ("ID", "Tiempo", "Ano", "Mes", "Dia", "Hora")
+
+
+# Tipo de cada columna al decodificar los resultados de SQLite (fetch_frame),
+# los mismos que regresa pd.read_sql y los otros almacenamientos
+DTYPES = {
+    "ID": np.int64,
+    "Tiempo": np.int64,
+    "Ano": np.int64,
+    "Mes": np.int64,
+    "Dia": np.int64,
+    "Hora": np.int64,
+    "Valor": np.float64,
+}
+
+
+def fetch_arrays(cursor, names, dtypes=None):
+    """
+    Lee los renglones del cursor directamente a un arreglo estructurado de
+    NumPy, sin listas intermedias ni inferencia de tipos (los valores nulos
+    son NaN). Regresa {columna: arreglo}.
+    """
+    dtypes = DTYPES if dtypes is None else dtypes
+    data = np.fromiter(cursor, dtype=np.dtype([(name, dtypes[name]) for name in names]))
+    return {name: data[name] for name in names}
+
+
+def fetch_frame(conn, query, columns):
+    """
+    Igual que pd.read_sql(query, conn) para consultas de registros de presiones
+    """
+    return pd.DataFrame(fetch_arrays(conn.execute(query), columns))
+
+
+def _cursor_frames(cursor, names, chunksize=65536):
+    # Renglones del cursor en DataFrames de a lo mas chunksize registros
+    while True:
+        block = fetch_arrays(itertools.islice(cursor, chunksize), names)
+        if len(block[names[0]]) == 0:
+            break
+        yield pd.DataFrame(block)
+
+
+def _split_windows(frames, start, step):
+    """
+    Agrupa DataFrames ordenados por Tiempo en intervalos de step segundos
+    desde start. Regresa solo los intervalos con registros.
+    """
+    pending = []
+    window = None
+    for frame in frames:
+        keys = (frame["Tiempo"].values - start) // step
+        cuts = np.r_[0, np.flatnonzero(keys[1:] != keys[:-1]) + 1, len(keys)]
+        for first, last in zip(cuts[:-1], cuts[1:]):
+            if window is not None and keys[first] != window:
+                yield pd.concat(pending, ignore_index=True)
+                pending = []
+            window = keys[first]
+            pending.append(frame.iloc[first:last])
+    if pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def _window_reads(storage, columns, ids, time, step):
+    # iter_read con una lectura por intervalo
+    for start in range(int(time[0]), int(time[1]) + 1, step):
+        df = storage.read(columns, ids, time=(start, min(start + step - 1, int(time[1]))),
+                          order=["Tiempo", "ID"])
+        if len(df) > 0:
+            yield df
+
+
+def _years(time1, time2):
+    # Años que cubre un intervalo de segundos epoch
+    years = np.array([time1, time2], dtype="datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+    return int(years[0]), int(years[1])
+
+
+def _period(year=None, month=None, day=None, hour=None):
+    # Intervalo (tiempo1, tiempo2) en segundos epoch (inclusivo) del año, mes,
+    # dia y hora indicados (hasta el primer None); None sin año o si la fecha
+    # no existe
+    if year is None:
+        return None
+    parts = [int(year)]
+    for value in (month, day, hour):
+        if value is None:
+            break
+        parts.append(int(value))
+    try:
+        start = pd.Timestamp(*(parts + [1, 1, 0][len(parts) - 1:]))
+    except ValueError:
+        return None
+    end = start + pd.DateOffset(**{("years", "months", "days", "hours")[len(parts) - 1]: 1})
+    epoch = pd.Timestamp(1970, 1, 1)
+    return (start - epoch) // pd.Timedelta(1, "s"), (end - epoch) // pd.Timedelta(1, "s") - 1
+
+
+def _calendar(times):
+    # Ano, Mes, Dia y Hora de tiempos epoch (segundos)
+    dates = np.asarray(times, dtype="datetime64[s]")
+    days = dates.astype("datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    return {
+        "Ano": months.astype(np.int64) // 12 + 1970,
+        "Mes": months.astype(np.int64) % 12 + 1,
+        "Dia": (days - months.astype("datetime64[D]")).astype(np.int64) + 1,
+        "Hora": (dates - days).astype(np.int64) // 3600,
+    }
+
+
+def _merge(old, new):
+    """
+    Registros de new que no existen en old o cambian de valor, y la union de
+    ambos conservando los valores de new
+    """
+    joined = new.merge(old.loc[:, ["ID", "Tiempo", "Valor"]], on=["ID", "Tiempo"],
+                       how="left", suffixes=("", "_old"), indicator=True)
+    same = (joined["_merge"] == "both") & (
+        (joined["Valor"] == joined["Valor_old"])
+        | (joined["Valor"].isna() & joined["Valor_old"].isna())
+    )
+    changed = new.loc[~same.values, :]
+    merged = pd.concat([old, changed.loc[:, list(COLUMNS)]], ignore_index=True)
+    merged = merged.drop_duplicates(["ID", "Tiempo"], keep="last")
+    return changed, merged
+
+
+#%% Clases
+
+class SQLiteStorage:
+    """
+    Registros de presiones en la tabla de SQLite (almacenamiento por omision)
+    """
+
+    name = "sqlite"
+
+    def __init__(self, conn, ptable="presiones"):
+        self.conn = conn
+        self.ptable = ptable
+
+    @staticmethod
+    def _where(ids=None, time=None, year=None, month=None, day=None, hour=None):
+        conditions = []
+        if ids is not None:
+            if len(ids) == 1:
+                conditions.append(f"ID = {int(ids[0])}")
+            else:
+                conditions.append(f"ID IN ({', '.join([str(int(x)) for x in ids])})")
+        if time is not None:
+            conditions.append(f"Tiempo BETWEEN {int(time[0])} AND {int(time[1])}")
+        fields = (("Ano", year), ("Mes", month), ("Dia", day), ("Hora", hour))
+        period = _period(year, month, day, hour)
+        if period is not None:
+            # intervalo de Tiempo en lugar de las igualdades de año, mes, dia y
+            # hora (hasta el primer None) para usar la llave (ID, Tiempo) o el
+            # indice de tiempo
+            conditions.append(f"Tiempo BETWEEN {period[0]} AND {period[1]}")
+            fields = fields[next((i for i, x in enumerate(fields) if x[1] is None), len(fields)):]
+        for field, value in fields:
+            if value is not None:
+                conditions.append(f"{field} = {int(value)}")
+        if conditions:
+            return " WHERE " + " AND ".join(conditions)
+        return ""
+
+    def read(self, columns, ids=None, time=None, year=None, month=None, day=None,
+             hour=None, order=None):
+        """
+        Registros con las columnas indicadas. ids: lista de estaciones,
+        time: (tiempo1, tiempo2) en segundos epoch (inclusivo), year, month,
+        day y hour: igualdad. order: columnas de ordenamiento.
+        """
+        query = f"SELECT {', '.join(columns)} FROM {self.ptable}"
+        query += self._where(ids, time, year, month, day, hour)
+        if order:
+            query += f" ORDER BY {', '.join(order)}"
+        return fetch_frame(self.conn, query, columns)
+
+    def iter_read(self, columns, ids, time, step):
+        """
+        Registros del periodo time (inclusivo) en intervalos de step segundos,
+        ordenados por tiempo y estacion. Recorre un solo cursor, la memoria
+        utilizada depende de step y no del periodo.
+        """
+        names = list(columns) + ([] if "Tiempo" in columns else ["Tiempo"])
+        query = f"SELECT {', '.join(names)} FROM {self.ptable}"
+        query += self._where(ids, time) + " ORDER BY Tiempo, ID"
+        frames = _cursor_frames(self.conn.execute(query), names)
+        for frame in _split_windows(frames, int(time[0]), step):
+            yield frame.loc[:, list(columns)]
+
+    def blocks(self, chunksize=1_000_000):
+        """
+        Todos los registros en bloques (ids, tiempos, valores)
+        """
+        cursor = self.conn.execute(f"SELECT ID, Tiempo, Valor FROM {self.ptable}")
+        while True:
+            block = fetch_arrays(itertools.islice(cursor, chunksize), ("ID", "Tiempo", "Valor"))
+            if len(block["ID"]) == 0:
+                break
+            yield block["ID"], block["Tiempo"], block["Valor"]
+
+
+class ParquetStorage:
+    """
+    Registros de presiones en archivos Parquet particionados por año y mes
+    (folder/Ano=2021/Mes=01/presiones.parquet), ordenados por ID y Tiempo.
+    Las particiones se eligen a partir del periodo consultado y los filtros
+    de estacion y tiempo se evaluan con las estadisticas de cada grupo de
+    renglones; solo se leen las columnas solicitadas.
+    Requiere pyarrow.
+    """
+
+    name = "parquet"
+
+    def __init__(self, folder, row_group_size=65536):
+        if pa is None:
+            raise ImportError("Se requiere pyarrow para el almacenamiento en Parquet.")
+        self.folder = folder
+        self.row_group_size = row_group_size
+        # particiones escritas por upsert pendientes de commit
+        self.pending = []
+        self.schema = pa.schema([
+            ("ID", pa.int32()),
+            ("Tiempo", pa.int64()),
+            ("Ano", pa.int16()),
+            ("Mes", pa.int8()),
+            ("Dia", pa.int8()),
+            ("Hora", pa.int8()),
+            ("Valor", pa.float64()),
+        ])
+
+    def _fname(self, year, month):
+        return os.path.join(self.folder, f"Ano={int(year)}", f"Mes={int(month):02d}", "presiones.parquet")
+
+    def months(self):
+        """
+        Particiones existentes como lista ordenada de (año, mes)
+        """
+        months = []
+        if not os.path.exists(self.folder):
+            return months
+        for ydir in os.listdir(self.folder):
+            if not ydir.startswith("Ano="):
+                continue
+            for mdir in os.listdir(os.path.join(self.folder, ydir)):
+                if mdir.startswith("Mes=") and os.path.exists(self._fname(ydir[4:], mdir[4:])):
+                    months.append((int(ydir[4:]), int(mdir[4:])))
+        return sorted(months)
+
+    def _files(self, time=None, year=None, month=None):
+        months = self.months()
+        if time is not None:
+            year1, year2 = _years(time[0], time[1])
+            months = [x for x in months if year1 <= x[0] <= year2]
+        if year is not None:
+            months = [x for x in months if x[0] == int(year)]
+        if month is not None:
+            months = [x for x in months if x[1] == int(month)]
+        return [self._fname(*x) for x in months]
+
+    def _empty(self, columns):
+        return pd.DataFrame({
+            name: pd.Series([], dtype=np.int64 if name in INTEGER_COLUMNS else np.float64)
+            for name in columns
+        })
+
+    def read(self, columns, ids=None, time=None, year=None, month=None, day=None,
+             hour=None, order=None):
+        """
+        Igual que SQLiteStorage.read
+        """
+        files = self._files(time, year, month)
+        if not files:
+            return self._empty(columns)
+        condition = None
+        filters = []
+        if ids is not None:
+            ids = [int(x) for x in ids]
+            filters.append(ds.field("ID") == ids[0] if len(ids) == 1 else ds.field("ID").isin(ids))
+        if time is not None:
+            filters.append((ds.field("Tiempo") >= int(time[0])) & (ds.field("Tiempo") <= int(time[1])))
+        for field, value in (("Ano", year), ("Mes", month), ("Dia", day), ("Hora", hour)):
+            if value is not None:
+                filters.append(ds.field(field) == int(value))
+        for expression in filters:
+            condition = expression if condition is None else condition & expression
+        order = list(order or [])
+        names = list(columns) + [x for x in order if x not in columns]
+        dataset = ds.dataset(files, schema=self.schema, format="parquet")
+        df = dataset.to_table(columns=names, filter=condition).to_pandas()
+        if order and len(files) > 1:
+            df = df.sort_values(order, kind="stable", ignore_index=True)
+        df = df.astype({name: np.int64 for name in names if name in INTEGER_COLUMNS})
+        return df.loc[:, list(columns)]
+
+    def read_month(self, year, month):
+        fname = self._fname(year, month)
+        if not os.path.exists(fname):
+            return self._empty(COLUMNS)
+        df = pq.read_table(fname, schema=self.schema).to_pandas()
+        return df.astype({name: np.int64 for name in INTEGER_COLUMNS})
+
+    def write_month(self, year, month, frame, stage=False):
+        """
+        Reescribe la particion de un mes con los registros de frame
+        (columnas COLUMNS). La escritura es atomica. Con stage=True el
+        archivo queda como temporal hasta commit (o se descarta con rollback).
+        """
+        fname = self._fname(year, month)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        frame = frame.sort_values(["ID", "Tiempo"], ignore_index=True)
+        table = pa.Table.from_pandas(frame.loc[:, list(COLUMNS)], schema=self.schema, preserve_index=False)
+        pq.write_table(table, fname + ".tmp", row_group_size=self.row_group_size, compression="zstd")
+        if stage:
+            self.pending.append(fname)
+        else:
+            os.replace(fname + ".tmp", fname)
+
+    def commit(self):
+        """
+        Reemplaza las particiones con los temporales escritos por upsert
+        """
+        while self.pending:
+            fname = self.pending.pop(0)
+            os.replace(fname + ".tmp", fname)
+
+    def rollback(self):
+        """
+        Descarta los temporales escritos por upsert
+        """
+        while self.pending:
+            fname = self.pending.pop()
+            if os.path.exists(fname + ".tmp"):
+                os.remove(fname + ".tmp")
+
+    def upsert(self, frame):
+        """
+        Agrega o actualiza registros (columnas COLUMNS, sin repetidos en
+        ID y Tiempo). Solo se reescriben los meses con cambios, como
+        temporales que se aplican con commit o se descartan con rollback.
+        Regresa el numero de registros modificados y los registros completos
+        de los grupos (ID, Ano, Mes) modificados.
+        """
+        changes = 0
+        groups = []
+        for (year, month), new in frame.groupby(["Ano", "Mes"], sort=True):
+            changed, merged = _merge(self.read_month(year, month), new)
+            if len(changed) == 0:
+                continue
+            self.write_month(year, month, merged, stage=True)
+            changes += len(changed)
+            groups.append(merged.loc[merged["ID"].isin(changed["ID"].unique()), :])
+        if groups:
+            return changes, pd.concat(groups, ignore_index=True)
+        return changes, self._empty(COLUMNS)
+
+    def iter_read(self, columns, ids, time, step):
+        """
+        Igual que SQLiteStorage.iter_read, con una lectura por intervalo
+        """
+        return _window_reads(self, columns, ids, time, step)
+
+    def blocks(self, chunksize=1_000_000):
+        """
+        Igual que SQLiteStorage.blocks
+        """
+        files = self._files()
+        if not files:
+            return
+        dataset = ds.dataset(files, schema=self.schema, format="parquet")
+        for batch in dataset.to_batches(columns=["ID", "Tiempo", "Valor"], batch_size=chunksize):
+            if batch.num_rows == 0:
+                continue
+            yield (
+                batch.column(0).to_numpy().astype(np.int64),
+                batch.column(1).to_numpy().astype(np.int64),
+                batch.column(2).to_numpy(zero_copy_only=False).astype(np.float64),
+            )
+
+
+class BlockStorage:
+    """
+    Registros de presiones comprimidos en la base de datos SQLite, un bloque
+    por estacion y mes (tabla {ptable}_bloques): valores int16 en milesimas
+    de kg/cm2 y tiempos como diferencias int32 con el registro anterior,
+    ambos comprimidos con zlib. Los valores se redondean a 0.001 kg/cm2 y
+    deben estar entre -32.768 y 32.767 kg/cm2.
+    """
+
+    name = "bloques"
+    scale = 1000
+
+    def __init__(self, conn, ptable="presiones"):
+        self.conn = conn
+        self.ptable = ptable
+        self.table = f"{ptable}_bloques"
+
+    def create(self):
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (ID INTEGER NOT NULL, Ano INTEGER NOT NULL,"
+            " Mes INTEGER NOT NULL, Inicio INTEGER NOT NULL, Final INTEGER NOT NULL,"
+            " Registros INTEGER NOT NULL, Tiempos BLOB NOT NULL, Valores BLOB NOT NULL)"
+        )
+        self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{self.table}_llave ON {self.table} (ID, Ano, Mes)")
+
+    def encode(self, ide, year, month, times, values):
+        """
+        Renglon del bloque de una estacion y mes (tiempos ordenados)
+        """
+        quantized = np.rint(np.asarray(values, dtype=np.float64) * self.scale)
+        limits = np.iinfo(np.int16)
+        if np.isnan(quantized).any() or (quantized < limits.min).any() or (quantized > limits.max).any():
+            raise ValueError(f"La estación {ide} tiene presiones faltantes o fuera del rango del almacenamiento por bloques.")
+        times = np.asarray(times, dtype=np.int64)
+        deltas = np.diff(times).astype(np.int32)
+        return (
+            int(ide), int(year), int(month), int(times[0]), int(times[-1]), len(times),
+            zlib.compress(deltas.tobytes()), zlib.compress(quantized.astype(np.int16).tobytes()),
+        )
+
+    def decode(self, start, tblob, vblob):
+        deltas = np.frombuffer(zlib.decompress(tblob), dtype=np.int32)
+        times = np.empty(len(deltas) + 1, dtype=np.int64)
+        times[0] = start
+        np.cumsum(deltas, out=times[1:])
+        times[1:] += start
+        values = np.frombuffer(zlib.decompress(vblob), dtype=np.int16) / self.scale
+        return times, values
+
+    def _decoded(self, ids=None, time=None, year=None, month=None):
+        # ID, Tiempo y Valor de los bloques que cumplen los filtros, ordenados
+        # por estacion y tiempo
+        conditions = []
+        if ids is not None:
+            conditions.append(f"ID IN ({', '.join([str(int(x)) for x in ids])})")
+        if time is not None:
+            conditions.append(f"Final >= {int(time[0])} AND Inicio <= {int(time[1])}")
+        if year is not None:
+            conditions.append(f"Ano = {int(year)}")
+        if month is not None:
+            conditions.append(f"Mes = {int(month)}")
+        query = f"SELECT ID, Inicio, Registros, Tiempos, Valores FROM {self.table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY ID, Ano, Mes"
+        blocks = self.conn.execute(query).fetchall()
+        if not blocks:
+            return (np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                    np.array([], dtype=np.float64))
+        decoded = [self.decode(start, tblob, vblob) for _, start, _, tblob, vblob in blocks]
+        return (
+            np.repeat(np.array([row[0] for row in blocks], dtype=np.int64), [row[2] for row in blocks]),
+            np.concatenate([x[0] for x in decoded]),
+            np.concatenate([x[1] for x in decoded]),
+        )
+
+    def read(self, columns, ids=None, time=None, year=None, month=None, day=None,
+             hour=None, order=None):
+        """
+        Igual que SQLiteStorage.read
+        """
+        block_ids, times, values = self._decoded(ids, time, year, month)
+        data = {"ID": block_ids, "Tiempo": times, "Valor": values}
+        if set(columns) - set(data) or day is not None or hour is not None:
+            data.update(_calendar(times))
+        mask = np.ones(len(times), dtype=bool)
+        if time is not None:
+            mask &= (times >= int(time[0])) & (times <= int(time[1]))
+        for field, value in (("Dia", day), ("Hora", hour)):
+            if value is not None:
+                mask &= data[field] == int(value)
+        names = list(columns) + [x for x in (order or []) if x not in columns]
+        df = pd.DataFrame({name: data[name][mask] for name in names})
+        if order:
+            df = df.sort_values(list(order), kind="stable", ignore_index=True)
+        return df.loc[:, list(columns)]
+
+    def write_month(self, year, month, frame):
+        """
+        Reescribe los bloques del mes para las estaciones de frame
+        (columnas ID, Tiempo y Valor). No confirma la transaccion.
+        """
+        frame = frame.sort_values(["ID", "Tiempo"])
+        rows = [
+            self.encode(ide, year, month, group["Tiempo"].values, group["Valor"].values)
+            for ide, group in frame.groupby("ID", sort=True)
+        ]
+        self.conn.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def upsert(self, frame):
+        """
+        Igual que ParquetStorage.upsert, dentro de la transaccion de la conexion
+        """
+        changes = 0
+        groups = []
+        for (year, month), new in frame.groupby(["Ano", "Mes"], sort=True):
+            old = self.read(COLUMNS, ids=new["ID"].unique(), year=year, month=month)
+            changed, merged = _merge(old, new)
+            if len(changed) == 0:
+                continue
+            merged = merged.loc[merged["ID"].isin(changed["ID"].unique()), :]
+            self.write_month(year, month, merged)
+            changes += len(changed)
+            groups.append(merged)
+        if groups:
+            return changes, pd.concat(groups, ignore_index=True)
+        return changes, self.read(COLUMNS, ids=[])
+
+    def iter_read(self, columns, ids, time, step):
+        """
+        Igual que SQLiteStorage.iter_read, con una lectura por intervalo
+        """
+        return _window_reads(self, columns, ids, time, step)
+
+    def blocks(self, chunksize=1_000_000):
+        """
+        Igual que SQLiteStorage.blocks
+        """
+        cursor = self.conn.execute(f"SELECT ID, Inicio, Registros, Tiempos, Valores FROM {self.table}")
+        while True:
+            rows = cursor.fetchmany(max(chunksize // 744, 1))
+            if not rows:
+                break
+            decoded = [self.decode(start, tblob, vblob) for _, start, _, tblob, vblob in rows]
+            yield (
+                np.repeat(np.array([row[0] for row in rows], dtype=np.int64), [row[2] for row in rows]),
+                np.concatenate([x[0] for x in decoded]),
+                np.concatenate([x[1] for x in decoded]),
+            )
+
+
+class AnnualStorage:
+    """
+    Registros de presiones en un archivo SQLite por año
+    (folder/Presiones_2021.sqlite, misma tabla e indices que la base de datos
+    principal) que se adjuntan a la conexion (ATTACH) solo para los años
+    consultados. Los años cerrados (seal) son archivos de solo lectura que
+    se adjuntan con immutable=1, sin bloqueos.
+    """
+
+    name = "anual"
+    # ATTACH admite 10 bases de datos por conexion
+    max_attached = 8
+
+    def __init__(self, conn, folder, fields, key, indexes, ptable="presiones", readonly=False):
+        self.conn = conn
+        self.folder = folder
+        self.fields = fields
+        self.key = key
+        self.indexes = indexes
+        self.ptable = ptable
+        self.readonly = readonly
+
+    def _fname(self, year):
+        return os.path.join(self.folder, f"Presiones_{int(year)}.sqlite")
+
+    def years(self):
+        years = []
+        if os.path.exists(self.folder):
+            for fname in os.listdir(self.folder):
+                match = re.fullmatch(r"Presiones_(\d{4})\.sqlite", fname)
+                if match:
+                    years.append(int(match.group(1)))
+        return sorted(years)
+
+    def sealed(self, year):
+        fname = self._fname(year)
+        return os.path.exists(fname) and not os.stat(fname).st_mode & stat.S_IWUSR
+
+    def create(self, year):
+        """
+        Crea el archivo del año si no existe
+        """
+        fname = self._fname(year)
+        if os.path.exists(fname):
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        conn = sqlite3.connect(fname)
+        try:
+            fieldstr = ", ".join([f"{name} {value}" for name, value in self.fields.items()])
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.ptable} ({fieldstr}, PRIMARY KEY ({', '.join(self.key)})) WITHOUT ROWID"
+            )
+            for name, columns in self.indexes.items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.ptable}_{name} ON {self.ptable} ({', '.join(columns)})")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def seal(self, year):
+        """
+        Cierra un año: compacta el archivo, elimina el registro WAL y lo deja
+        de solo lectura. Los años cerrados no admiten escrituras.
+        """
+        fname = self._fname(year)
+        self.detach(year)
+        conn = sqlite3.connect(fname, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        os.chmod(fname, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    def _attached(self):
+        # Años adjuntos {año: nombre}; los cerrados se adjuntan como s2021
+        # (immutable=1) y los demas como y2021
+        names = [row[1] for row in self.conn.execute("PRAGMA database_list")]
+        return {int(name[1:]): name for name in names if name[:1] in ("s", "y") and name[1:].isdigit()}
+
+    def detach(self, year=None):
+        for x, name in sorted(self._attached().items()):
+            if year is None or x == int(year):
+                self.conn.execute(f"DETACH DATABASE {name}")
+
+    def attach(self, years, create=False):
+        """
+        Adjunta los años indicados que existan (o los crea con create=True).
+        No se puede llamar dentro de una transaccion.
+        """
+        years = [int(x) for x in years]
+        attached = self._attached()
+        # un año cerrado desde otra conexion sigue adjunto para escritura,
+        # se vuelve a adjuntar con immutable=1
+        for x, name in sorted(attached.items()):
+            if name.startswith("y") and self.sealed(x):
+                self.conn.execute(f"DETACH DATABASE {name}")
+                del attached[x]
+        missing = [x for x in years if x not in attached]
+        if not missing:
+            return
+        if len(attached) + len(missing) > self.max_attached:
+            for x, name in sorted(attached.items()):
+                if x not in years:
+                    self.conn.execute(f"DETACH DATABASE {name}")
+        for year in missing:
+            if create and not self.readonly:
+                self.create(year)
+            fname = self._fname(year)
+            if not os.path.exists(fname):
+                continue
+            uri = f"file:{pathname2url(fname)}"
+            if self.sealed(year):
+                uri += "?mode=ro&immutable=1"
+                name = f"s{year}"
+            else:
+                if self.readonly:
+                    uri += "?mode=ro"
+                name = f"y{year}"
+            self.conn.execute("ATTACH DATABASE ? AS ?", (uri, name))
+
+    def _needed(self, time=None, year=None):
+        years = self.years()
+        if time is not None:
+            year1, year2 = _years(time[0], time[1])
+            years = [x for x in years if year1 <= x <= year2]
+        if year is not None:
+            years = [x for x in years if x == int(year)]
+        return years
+
+    def read(self, columns, ids=None, time=None, year=None, month=None, day=None,
+             hour=None, order=None):
+        """
+        Igual que SQLiteStorage.read, consulta solo los años del periodo
+        """
+        years = self._needed(time, year)
+        if len(years) > self.max_attached:
+            parts = []
+            for i in range(0, len(years), self.max_attached):
+                parts.append(self._read(years[i:i + self.max_attached], columns, ids, time, year,
+                                        month, day, hour, order))
+        else:
+            parts = [self._read(years, columns, ids, time, year, month, day, hour, order)]
+        parts = [x for x in parts if len(x) > 0]
+        if not parts:
+            return pd.DataFrame({name: [] for name in columns})
+        if len(parts) == 1:
+            return parts[0]
+        df = pd.concat(parts, ignore_index=True)
+        if order:
+            df = df.sort_values(list(order), kind="stable", ignore_index=True)
+        return df
+
+    def _read(self, years, columns, ids, time, year, month, day, hour, order):
+        self.attach(years)
+        attached = self._attached()
+        where = SQLiteStorage._where(ids, time, year, month, day, hour)
+        # ORDER BY de una consulta compuesta solo admite columnas del resultado
+        names = list(columns) + [x for x in (order or []) if x not in columns]
+        queries = [
+            f"SELECT {', '.join(names)} FROM {attached[x]}.{self.ptable}{where}"
+            for x in years if x in attached
+        ]
+        if not queries:
+            return pd.DataFrame({name: [] for name in columns})
+        query = " UNION ALL ".join(queries)
+        if order:
+            query += f" ORDER BY {', '.join(order)}"
+        return fetch_frame(self.conn, query, names).loc[:, list(columns)]
+
+    def _rows(self, frame):
+        times = frame["Tiempo"].values.astype("datetime64[s]")
+        text = np.char.replace(np.datetime_as_string(times, unit="s"), "T", " ")
+        data = frame.assign(Fecha=text).loc[:, list(self.fields.keys())]
+        return data.astype(object).values.tolist()
+
+    def prepare(self, frame):
+        """
+        Adjunta (y crea) los años de frame antes de abrir la transaccion
+        """
+        for year in frame["Ano"].unique():
+            if self.sealed(year):
+                raise ValueError(f"El año {int(year)} está cerrado y es de solo lectura.")
+        self.attach(frame["Ano"].unique(), create=True)
+
+    def write_month(self, year, month, frame):
+        """
+        Inserta los registros de un mes (columnas COLUMNS).
+        No confirma la transaccion, requiere prepare.
+        """
+        fields = ", ".join(self.fields.keys())
+        marks = ", ".join(["?"] * len(self.fields))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO y{int(year)}.{self.ptable} ({fields}) VALUES ({marks})",
+            self._rows(frame)
+        )
+
+    def upsert(self, frame):
+        """
+        Igual que ParquetStorage.upsert dentro de la transaccion de la
+        conexion, requiere prepare
+        """
+        fields = ", ".join(self.fields.keys())
+        marks = ", ".join(["?"] * len(self.fields))
+        changes = 0
+        groups = []
+        for year, new in frame.groupby("Ano", sort=True):
+            total = self.conn.total_changes
+            self.conn.executemany(
+                f"INSERT INTO y{int(year)}.{self.ptable} ({fields}) VALUES ({marks})"
+                f" ON CONFLICT ({', '.join(self.key)}) DO UPDATE SET Valor = excluded.Valor"
+                " WHERE Valor IS NOT excluded.Valor",
+                self._rows(new)
+            )
+            if self.conn.total_changes == total:
+                continue
+            changes += self.conn.total_changes - total
+            for month, keys in new.groupby("Mes"):
+                groups.append(self._read([year], COLUMNS, keys["ID"].unique(), None, year,
+                                         month, None, None, None))
+        if groups:
+            return changes, pd.concat(groups, ignore_index=True)
+        return changes, pd.DataFrame({name: [] for name in COLUMNS})
+
+    def iter_read(self, columns, ids, time, step):
+        """
+        Igual que SQLiteStorage.iter_read, con una lectura por intervalo
+        """
+        return _window_reads(self, columns, ids, time, step)
+
+    def blocks(self, chunksize=1_000_000):
+        """
+        Igual que SQLiteStorage.blocks, un año a la vez
+        """
+        for year in self.years():
+            self.attach([year])
+            name = self._attached().get(year)
+            if name is None:
+                continue
+            cursor = self.conn.execute(f"SELECT ID, Tiempo, Valor FROM {name}.{self.ptable}")
+            while True:
+                block = fetch_arrays(itertools.islice(cursor, chunksize), ("ID", "Tiempo", "Valor"))
+                if len(block["ID"]) == 0:
+                    break
+                yield block["ID"], block["Tiempo"], block["Valor"]
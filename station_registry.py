@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de estaciones en memoria con consultas espaciales
+
+@author: zaula
+"""
+
+#%% Importar librerias
+import threading
+import numpy as np
+import pandas as pd
+
+
+# Radio medio de la Tierra (km)
+EARTH_RADIUS = 6371.0088
+
+
+#%% Funciones
+
+def haversine(x1, y1, x2, y2):
+    """
+    Distancia (km) entre coordenadas geograficas X (longitud), Y (latitud)
+    """
+    x1, y1, x2, y2 = map(np.radians, (x1, y1, x2, y2))
+    a = np.sin((y2 - y1) / 2.0) ** 2 + np.cos(y1) * np.cos(y2) * np.sin((x2 - x1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+#%% Clases
+
+class StationRegistry:
+    """
+    Tabla de estaciones cargada una vez por proceso. Cada columna se guarda
+    como arreglo de numpy y el indice ID -> renglon permite seleccionar
+    varias estaciones sin consultar SQLite. Se recarga cuando cambia la
+    version de estaciones (update_stations); la tabla, los arreglos y el
+    indice se reemplazan juntos bajo lock (reentrante) y las consultas toman
+    el mismo lock.
+    """
+
+    def __init__(self):
+        self.table = None
+        self.columns = {}
+        self.ids = np.array([], dtype=np.int64)
+        self.index = {}
+        self.x = np.array([], dtype=np.float64)
+        self.y = np.array([], dtype=np.float64)
+        self.version = None
+        self.lock = threading.RLock()
+
+    def load(self, table, version):
+        table = table.reset_index(drop=True)
+        columns = {key: table[key].to_numpy() for key in table.columns}
+        ids = table["ID"].to_numpy(dtype=np.int64)
+        index = {int(ide): row for row, ide in enumerate(ids)}
+        x = table["X"].to_numpy(dtype=np.float64)
+        y = table["Y"].to_numpy(dtype=np.float64)
+        with self.lock:
+            self.table, self.columns, self.ids, self.index = table, columns, ids, index
+            self.x, self.y = x, y
+            self.version = version
+
+    def rows(self, ids):
+        """
+        Renglon de cada estacion en el registro, -1 si no existe
+        """
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        with self.lock:
+            return np.array([self.index.get(int(ide), -1) for ide in ids], dtype=np.int64)
+
+    def frame(self, rows=None):
+        """
+        Tabla de estaciones (indice ID) de los renglones indicados
+        """
+        with self.lock:
+            table = self.table if rows is None else self.table.iloc[rows]
+        return table.set_index("ID", drop=False)
+
+    def lookup(self, ids):
+        """
+        Estaciones de una lista de IDs en el orden solicitado, sin faltantes
+        """
+        with self.lock:
+            rows = self.rows(ids)
+            return self.frame(rows[rows >= 0])
+
+    def station(self, ide):
+        with self.lock:
+            row = self.index.get(int(ide))
+            if row is None:
+                return pd.Series([], dtype=np.float32)
+            table = self.table.iloc[[row]]
+        return table.reset_index(drop=True).squeeze(axis=0)
+
+    def in_bbox(self, xmin, ymin, xmax, ymax):
+        """
+        Estaciones dentro del rectangulo [xmin, xmax] x [ymin, ymax]
+        """
+        with self.lock:
+            mask = (self.x >= xmin) & (self.x <= xmax) & (self.y >= ymin) & (self.y <= ymax)
+            return self.frame(np.flatnonzero(mask))
+
+    def distances(self, x, y):
+        with self.lock:
+            return haversine(x, y, self.x, self.y)
+
+    def in_radius(self, x, y, radius):
+        """
+        Estaciones a una distancia maxima radius (km) del punto (x, y),
+        ordenadas por distancia, con la columna Distancia (km)
+        """
+        # descarte previo con el rectangulo que contiene al circulo
+        dy = np.degrees(radius / EARTH_RADIUS)
+        dx = dy / max(np.cos(np.radians(y)), 1e-12)
+        with self.lock:
+            rows = np.flatnonzero((np.abs(self.x - x) <= dx) & (np.abs(self.y - y) <= dy))
+            distance = haversine(x, y, self.x[rows], self.y[rows])
+            order = np.argsort(distance, kind="stable")
+            rows, distance = rows[order], distance[order]
+            mask = distance <= radius
+            table = self.frame(rows[mask])
+        table["Distancia"] = distance[mask]
+        return table
+
+    def nearest(self, x, y, k=1):
+        """
+        Las k estaciones mas cercanas al punto (x, y), con la columna
+        Distancia (km)
+        """
+        with self.lock:
+            distance = self.distances(x, y)
+            k = min(int(k), len(distance))
+            if k <= 0:
+                rows = np.array([], dtype=np.int64)
+            elif k < len(distance):
+                rows = np.argpartition(distance, k - 1)[:k]
+                rows = rows[np.argsort(distance[rows], kind="stable")]
+            else:
+                rows = np.argsort(distance, kind="stable")
+            table = self.frame(rows)
+        table["Distancia"] = distance[rows]
+        return table
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(key):
+    """
+    Registro compartido por proceso para cada base de datos
+    """
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = StationRegistry()
+        return _registries[key]